@@ -1,4 +1,7 @@
+import asyncio
 import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from typing import Optional
 
 import httpx
@@ -9,8 +12,61 @@ logger = logging.getLogger(__name__)
 
 
 TIMEOUT = 180
+MAX_ATTEMPTS = 5
+MAX_BACKOFF_SECONDS = 30
+# a provider requested wait is honored up to this long
+MAX_RETRY_AFTER_SECONDS = 60
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
 
-model_client = httpx.AsyncClient()
+model_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+    timeout=httpx.Timeout(TIMEOUT),
+)
+
+
+# bounds in-flight requests to the provider to protect tail latency
+openai_semaphore = asyncio.Semaphore(settings.openai_max_concurrency)
+
+
+async def close_model_client() -> None:
+    await model_client.aclose()
+
+
+def _should_retry(exc: Exception) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUS_CODES
+    return isinstance(exc, (httpx.TimeoutException, httpx.TransportError))
+
+
+def _retry_after_seconds(headers: httpx.Headers) -> Optional[float]:
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return max(float(retry_after_ms) / 1000, 0.0)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    # otherwise an http date to retry at
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def _backoff_seconds(exc: Exception, attempt: int) -> float:
+    if isinstance(exc, httpx.HTTPStatusError):
+        retry_after = _retry_after_seconds(exc.response.headers)
+        if retry_after is not None:
+            return min(retry_after, MAX_RETRY_AFTER_SECONDS)
+    return min(2**attempt, MAX_BACKOFF_SECONDS)
 
 
 async def _core_send_request(
@@ -36,6 +92,7 @@ async def send_openai_request(
     files: Optional[dict] = None,
     data: Optional[dict] = None,
     timeout: int = TIMEOUT,
+    max_attempts: int = MAX_ATTEMPTS,
 ) -> dict:
     url = f"https://api.openai.com/v1/{route}"
     request_params = {
@@ -49,8 +106,16 @@ async def send_openai_request(
     if data:
         request_params["data"] = data
 
-    response_output = await _core_send_request(
-        url,
-        request_params,
-    )
-    return response_output
+    for attempt in range(max_attempts):
+        try:
+            async with openai_semaphore:
+                return await _core_send_request(url, request_params)
+        except Exception as e:
+            if attempt == max_attempts - 1 or not _should_retry(e):
+                raise
+            backoff = _backoff_seconds(e, attempt)
+            logger.warning(
+                f"OpenAI request to {route} failed, retrying in {backoff}s: {e}"
+            )
+            await asyncio.sleep(backoff)
+    raise RuntimeError("OpenAI request retries exhausted")
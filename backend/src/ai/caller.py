@@ -2,7 +2,6 @@ import asyncio
 import audioop
 import base64
 import io
-import json
 import logging
 import os
 import time
@@ -22,19 +21,19 @@ from typing import (
 )
 
 import aiofiles
+import orjson
 import websockets
 from pydantic import BaseModel, Field
-from pydantic.json import pydantic_encoder
 
 from src.ai.prompts import (
-    enter_keypad_tool,
-    hang_up_tools,
-    query_documents_tool,
-    text_message_tool,
-    transfer_call_tool,
+    enter_keypad_tool_json,
+    hang_up_tools_json,
+    query_documents_tool_json,
+    text_message_tool_json,
+    transfer_call_tool_json,
 )
-from src.audio.data_processing import audio_bytes_to_ms
-from src.aws_utils import S3Client
+from src.audio.data_processing import base64_decoded_length
+from src.aws_utils import get_s3_client
 from src.db.api import update_phone_call
 from src.db.base import async_session_scope
 from src.helixion_types import (
@@ -74,7 +73,8 @@ class AiSessionConfiguration(BaseModel):
     voice: Optional[Voice]
     instructions: Optional[str]
     input_audio_transcription: Optional[dict]
-    tools: list[dict] = Field(default_factory=list)
+    # pre-serialized tool definitions, spliced in by `session_update`
+    tools_json: list[bytes] = Field(default_factory=list, exclude=True)
 
     @classmethod
     def create(
@@ -86,24 +86,24 @@ class AiSessionConfiguration(BaseModel):
     ) -> "AiSessionConfiguration":
         system_message = system_prompt.format(**user_info)
 
-        tools: list[dict] = []
+        tools: list[bytes] = []
         if tool_configuration.get(ToolNames.hang_up.value, False):
-            tools.extend(hang_up_tools)
+            tools.extend(hang_up_tools_json)
         if (
             len(tool_configuration.get(ToolNames.query_documents.value, []))
             > 0
         ):
-            tools.append(query_documents_tool)
+            tools.append(query_documents_tool_json)
         if tool_configuration.get(ToolNames.enter_keypad.value, False):
-            tools.append(enter_keypad_tool)
+            tools.append(enter_keypad_tool_json)
         if len(tool_configuration.get(ToolNames.transfer_call.value, [])) > 0:
             tools.append(
-                transfer_call_tool(
+                transfer_call_tool_json(
                     tool_configuration[ToolNames.transfer_call.value]
                 )
             )
         if tool_configuration.get(ToolNames.send_text_message.value, False):
-            tools.append(text_message_tool)
+            tools.append(text_message_tool_json)
 
         return cls(
             turn_detection=TurnDetection(),
@@ -111,12 +111,23 @@ class AiSessionConfiguration(BaseModel):
             output_audio_format=audio_format,
             voice="shimmer",
             instructions=system_message,
-            tools=tools,
+            tools_json=tools,
             input_audio_transcription={
                 "model": "whisper-1",
             },
         )
 
+    @property
+    def session_update(self) -> str:
+        session = orjson.dumps(self.model_dump())
+        return (
+            b'{"type":"session.update","session":'
+            + session[:-1]
+            + b',"tools":['
+            + b",".join(self.tools_json)
+            + b"]}}"
+        ).decode("utf-8")
+
 
 class AiMessage(BaseModel):
     type: AiMessageEventTypes
@@ -133,31 +144,26 @@ class AiMessage(BaseModel):
                 pcm_data = base64.b64decode(cast(str, self.data))
                 pcm_16bit = audioop.ulaw2lin(pcm_data, 2)
                 self.data = base64.b64encode(pcm_16bit).decode("utf-8")
-            return (
-                json.dumps(
-                    {
-                        "type": self.type.value,
-                        "data": self.data,
-                    },
-                )
-                + "\n"
-            )
+            return orjson.dumps(
+                {
+                    "type": self.type.value,
+                    "data": self.data,
+                },
+                option=orjson.OPT_APPEND_NEWLINE,
+            ).decode("utf-8")
         else:
-            return (
-                json.dumps(
-                    {
-                        "type": self.type.value,
-                        "data": [
-                            segment.model_dump()
-                            for segment in cast(
-                                Sequence[SpeakerSegment], self.data
-                            )
-                        ],
-                    },
-                    default=pydantic_encoder,
-                )
-                + "\n"
-            )
+            return orjson.dumps(
+                {
+                    "type": self.type.value,
+                    "data": [
+                        segment.model_dump()
+                        for segment in cast(
+                            Sequence[SpeakerSegment], self.data
+                        )
+                    ],
+                },
+                option=orjson.OPT_APPEND_NEWLINE,
+            ).decode("utf-8")
 
 
 class AiMessageQueue:
@@ -265,11 +271,7 @@ class AiCaller(AsyncContextManager["AiCaller"]):
         return self._log_file
 
     async def initialize_session(self):
-        session_update = {
-            "type": "session.update",
-            "session": self.session_configuration.model_dump(),
-        }
-        await self.send_message(json.dumps(session_update))
+        await self.send_message(self.session_configuration.session_update)
 
     async def _log_message(self, message: websockets.Data):
         # Ensure log directory exists
@@ -299,12 +301,20 @@ class AiCaller(AsyncContextManager["AiCaller"]):
                 self._speaker_segments,
             )
 
+    def _speaker_segments_json(self) -> str:
+        # serialized once here so the router can forward the text as is
+        return orjson.dumps(
+            [segment.model_dump() for segment in self._speaker_segments]
+        ).decode("utf-8")
+
     async def _start_speaking_message(self):
         conversation_start_event = {
             "type": "response.create",
             "response": {},
         }
-        await self.send_message(json.dumps(conversation_start_event))
+        await self.send_message(
+            orjson.dumps(conversation_start_event).decode("utf-8")
+        )
         self._start_speaking_buffer_ms = None
 
     async def send_message(self, message: str) -> None:
@@ -319,7 +329,7 @@ class AiCaller(AsyncContextManager["AiCaller"]):
             "content_index": 0,
             "audio_end_ms": audio_end_ms,
         }
-        await self.send_message(json.dumps(truncate_event))
+        await self.send_message(orjson.dumps(truncate_event).decode("utf-8"))
 
     async def receive_tool_call_result(
         self,
@@ -336,21 +346,23 @@ class AiCaller(AsyncContextManager["AiCaller"]):
                 "output": output,
             },
         }
-        await self.send_message(json.dumps(tool_call_result_event))
+        await self.send_message(
+            orjson.dumps(tool_call_result_event).decode("utf-8")
+        )
         await self._start_speaking_message()
 
     def _audio_ms(self, audio_b64: str) -> int:
-        audio_bytes = base64.b64decode(audio_b64)
-        return audio_bytes_to_ms(
-            audio_bytes, self._bytes_per_sample, self._sampling_rate
+        return int(
+            (base64_decoded_length(audio_b64) / self._bytes_per_sample)
+            * 1000
+            / self._sampling_rate
         )
 
     async def receive_human_audio(self, audio: str):
-        audio_append = {
-            "type": "input_audio_buffer.append",
-            "audio": audio,
-        }
-        await self.send_message(json.dumps(audio_append))
+        # base64 needs no json escaping, so skip the encoder on this hot path
+        await self.send_message(
+            '{"type":"input_audio_buffer.append","audio":"' + audio + '"}'
+        )
 
         # if start speaking buffer is enabled, check if we need to send a start speaking message
         if (
@@ -384,7 +396,7 @@ class AiCaller(AsyncContextManager["AiCaller"]):
     async def _message_handler(self, message: websockets.Data) -> dict:
         asyncio.create_task(self._log_message(message))
 
-        response = json.loads(message)
+        response = orjson.loads(message)
 
         if response["type"] == "input_audio_buffer.speech_started":
             self._start_speaking_buffer_ms = (
@@ -450,7 +462,7 @@ class AiCaller(AsyncContextManager["AiCaller"]):
                     item_id=response["item_id"],
                 ),
             )
-            response["speaker_segments"] = self._speaker_segments
+            response["speaker_segments_json"] = self._speaker_segments_json()
         elif response["type"] == "response.audio_transcript.done":
             self._update_speaker_segments(
                 SpeakerSegment(
@@ -460,7 +472,7 @@ class AiCaller(AsyncContextManager["AiCaller"]):
                     item_id=response["item_id"],
                 ),
             )
-            response["speaker_segments"] = self._speaker_segments
+            response["speaker_segments_json"] = self._speaker_segments_json()
         elif response["type"] == "session.updated":
             # initialize start speaking buffer
             if self._start_speaking_buffer_ms is not None:
@@ -494,26 +506,24 @@ class AiCaller(AsyncContextManager["AiCaller"]):
             logger.info(f"Flushing {len(self._log_tasks)} log tasks")
             await asyncio.gather(*self._log_tasks, return_exceptions=True)
 
-        async with S3Client() as s3_client:
-            # Create zip file in memory
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(
-                zip_buffer, "w", zipfile.ZIP_DEFLATED
-            ) as zip_file:
-                async with aiofiles.open(self.log_file, mode="rb") as f:
-                    data = await f.read()
-                    # Add log file to zip with just the filename
-                    zip_file.writestr(Path(self.log_file).name, data)
-
-            # Reset buffer position
-            zip_buffer.seek(0)
-            zip_data = zip_buffer.getvalue()
-
-            # Upload zipped file
-            s3_filepath = f"s3://clinicontact/logs/{self.phone_call_id}.zip"
-            await s3_client.upload_file(
-                zip_data, s3_filepath, "application/zip"
-            )
+        s3_client = get_s3_client()
+        # Create zip file in memory
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(
+            zip_buffer, "w", zipfile.ZIP_DEFLATED
+        ) as zip_file:
+            async with aiofiles.open(self.log_file, mode="rb") as f:
+                data = await f.read()
+                # Add log file to zip with just the filename
+                zip_file.writestr(Path(self.log_file).name, data)
+
+        # Reset buffer position
+        zip_buffer.seek(0)
+        zip_data = zip_buffer.getvalue()
+
+        # Upload zipped file
+        s3_filepath = f"s3://clinicontact/logs/{self.phone_call_id}.zip"
+        await s3_client.upload_file(zip_data, s3_filepath, "application/zip")
 
         async with async_session_scope() as db:
             await update_phone_call(
@@ -19,6 +19,11 @@ document_cache: LRUCache[str, list[tuple[str, str, int]]] = LRUCache(
 )
 document_cache_lock = asyncio.Lock()
 
+# queries are answered during a live call, so they fail fast instead of
+# retrying while the caller waits
+QUERY_TIMEOUT = 20
+QUERY_MAX_ATTEMPTS = 1
+
 
 async def _get_documents(
     knowledge_base_ids: list[SerializedUUID],
@@ -77,6 +82,8 @@ async def _model_query_documents(
     response = await send_openai_request(
         model_payload.data,
         "chat/completions",
+        timeout=QUERY_TIMEOUT,
+        max_attempts=QUERY_MAX_ATTEMPTS,
     )
 
     return response["choices"][0]["message"]["content"]
@@ -111,6 +118,8 @@ async def _consolidate_answers(query: str, answers: list[str]) -> str:
     response = await send_openai_request(
         model_payload.data,
         "chat/completions",
+        timeout=QUERY_TIMEOUT,
+        max_attempts=QUERY_MAX_ATTEMPTS,
     )
 
     return response["choices"][0]["message"]["content"]
@@ -1,21 +1,90 @@
+import logging
+from functools import lru_cache
+
+import orjson
+import tiktoken
+
 from src.ai.api import send_openai_request
 from src.helixion_types import (
     ModelChat,
     ModelChatType,
     ModelType,
     OpenAiChatInput,
-    Prediction,
+    ResponseType,
 )
 
+logger = logging.getLogger(__name__)
+
+encoding = tiktoken.encoding_for_model("gpt-4o")
+
+# reports under this size are handled by the smaller model
+SMALL_REPORT_TOKENS = 500
+NOOP_REPORTS = {
+    "none",
+    "n/a",
+    "no changes",
+    "no changes needed",
+    "no changes required",
+    "no issues found",
+}
+
+
+@lru_cache(maxsize=256)
+def _token_count(text: str) -> int:
+    return len(encoding.encode(text))
+
+
+class InstructionUpdateError(Exception):
+    pass
+
+
+def _parse_instruction_edits(edits_raw: str) -> list[dict]:
+    try:
+        edits = orjson.loads(edits_raw)["edits"]
+    except (orjson.JSONDecodeError, KeyError, TypeError) as e:
+        logger.warning(f"Unable to parse instruction edits: {e}")
+        raise InstructionUpdateError("Unable to parse instruction edits")
+    if not isinstance(edits, list) or not all(
+        isinstance(edit, dict)
+        and isinstance(edit.get("find", ""), str)
+        and isinstance(edit.get("replace"), str)
+        for edit in edits
+    ):
+        logger.warning(f"Malformed instruction edits: {edits_raw}")
+        raise InstructionUpdateError("Malformed instruction edits")
+    return edits
+
+
+def _apply_instruction_edits(instructions: str, edits: list[dict]) -> str:
+    for edit in edits:
+        find = edit.get("find", "")
+        if find == "":
+            # an empty `find` appends new instructions
+            instructions = f"{instructions.rstrip()}\n{edit['replace']}"
+        elif find not in instructions:
+            logger.warning(f"Instruction edit target not found: {find}")
+            # a partly applied update is not saved
+            raise InstructionUpdateError("Instruction edit target not found")
+        else:
+            instructions = instructions.replace(find, edit["replace"], 1)
+    return instructions
+
 
 async def generate_updated_instructions_from_report(
     instructions: str, report: str
 ) -> str:
+    normalized_report = report.strip().rstrip(".").lower()
+    if normalized_report == "" or normalized_report in NOOP_REPORTS:
+        return instructions
+
     system_prompt = """
 - You are given a `report` of an analysis of previous calls and `instructions` for an AI call agent
 - Your task is to update the `instructions` based on the `report`
 - Do not remove instructions unless they directly contradict the report
-- Only return the updated `instructions`, do not include any other text
+- Return the changes as a JSON object of edits: {"edits": [{"find": "...", "replace": "..."}, ...]}
+   - `find` must be an exact substring of the `instructions`, `replace` is the text to substitute
+   - To add new instructions to the end, use an empty `find`
+   - Return {"edits": []} if no changes are needed
 """
     model_chat = [
         ModelChat(
@@ -30,8 +99,12 @@ async def generate_updated_instructions_from_report(
 
     model_payload = OpenAiChatInput(
         messages=model_chat,
-        model=ModelType.gpt4o,
-        prediction=Prediction(content=instructions),
+        model=(
+            ModelType.gpt4o_mini
+            if _token_count(report) < SMALL_REPORT_TOKENS
+            else ModelType.gpt4o
+        ),
+        response_format=ResponseType(),
     )
 
     response = await send_openai_request(
@@ -39,4 +112,7 @@ async def generate_updated_instructions_from_report(
         "chat/completions",
     )
 
-    return response["choices"][0]["message"]["content"]
+    edits = _parse_instruction_edits(
+        response["choices"][0]["message"]["content"]
+    )
+    return _apply_instruction_edits(instructions, edits)
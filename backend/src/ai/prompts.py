@@ -1,3 +1,7 @@
+from functools import lru_cache
+
+import orjson
+
 default_system_prompt = """- You are a helpful, witty, and friendly AI.
 - Act like a human, but remember that you aren't a human and that you can't do human things in the real world.
 - Your voice and personality should be warm and engaging, with a lively and playful tone.
@@ -88,9 +92,7 @@ text_message_tool = {
 }
 
 
-def transfer_call_tool(
-    transfer_call_numbers: list[dict[str, str]],
-) -> dict:
+def _build_transfer_call_tool(labels: tuple[str, ...]) -> dict:
     return {
         "type": "function",
         "name": "transfer_call",
@@ -101,9 +103,30 @@ def transfer_call_tool(
                 "phone_number_label": {
                     "type": "string",
                     "description": "The label of the phone number to transfer the call to",
-                    "enum": [item["label"] for item in transfer_call_numbers],
+                    "enum": list(labels),
                 },
             },
             "required": ["phone_number_label"],
         },
     }
+
+
+# only the serialized tool is cached, so callers cannot mutate shared state
+@lru_cache(maxsize=128)
+def _build_transfer_call_tool_json(labels: tuple[str, ...]) -> bytes:
+    return orjson.dumps(_build_transfer_call_tool(labels))
+
+
+def transfer_call_tool_json(
+    transfer_call_numbers: list[dict[str, str]],
+) -> bytes:
+    return _build_transfer_call_tool_json(
+        tuple(item["label"] for item in transfer_call_numbers)
+    )
+
+
+# tools serialized once at import, spliced into each realtime session update
+hang_up_tools_json = [orjson.dumps(tool) for tool in hang_up_tools]
+query_documents_tool_json = orjson.dumps(query_documents_tool)
+enter_keypad_tool_json = orjson.dumps(enter_keypad_tool)
+text_message_tool_json = orjson.dumps(text_message_tool)
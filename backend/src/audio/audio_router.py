@@ -1,18 +1,27 @@
-import json
+import asyncio
+import base64
 import logging
+import re
 import time
 import uuid
-from typing import Optional, Union
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Awaitable, Callable, Coroutine, Optional, Union
 
+import anyio
+import orjson
 import websockets
+from anyio.streams.memory import (
+    MemoryObjectReceiveStream,
+    MemoryObjectSendStream,
+)
 from fastapi import WebSocket
-from fastapi.encoders import jsonable_encoder
 from fastapi.websockets import WebSocketDisconnect, WebSocketState
 from pydantic import BaseModel
 
 from src.ai.caller import AiCaller
 from src.ai.document_query import query_documents
-from src.audio.sounds import get_sound_base64
+from src.audio.sounds import get_sound_media_frame
 from src.db.api import insert_phone_call_event, insert_text_message
 from src.db.base import async_session_scope
 from src.helixion_types import (
@@ -33,118 +42,400 @@ from src.twilio_utils import (
 
 logger = logging.getLogger(__name__)
 
+# handlers return True when the router loop should stop
+MessageHandler = Callable[[dict, WebSocket], Awaitable[Optional[bool]]]
+# function call handlers also receive the parsed call arguments
+FunctionHandler = Callable[[dict, dict, WebSocket], Awaitable[Optional[bool]]]
+
+# outbound frames are either dicts or pre-serialized json text
+Frame = Union[dict, str]
+
+# both twilio and the browser client put the event type first in media
+# frames, which lets the payload be read without parsing the whole frame
+MEDIA_FRAME_PREFIX = '{"event":"media"'
+MEDIA_PAYLOAD_RE = re.compile(r'"payload":"([^"\\]+)"')
+
+# the browser clear event carries no stream id, so it is a constant
+CLEAR_FRAME = '{"event":"clear"}'
+
+# ai messages buffered ahead of the websocket sender before backpressure
+AI_STREAM_CAPACITY = 32
+# frame batches buffered ahead of the websocket writer before backpressure
+FRAME_STREAM_CAPACITY = 64
+# upper bounds on how much ready ai output is drained into a single flush
+MAX_BATCH_MESSAGES = 20
+MAX_BATCH_AUDIO_MS = 200
+# window after an audio delta to wait for more deltas to coalesce with
+AUDIO_COALESCE_SECONDS = 0.010
+
 
 class HangUpReason(BaseModel):
     reason: PhoneCallEndReason
     data: dict
 
 
-class CallRouter:
+def _now_ms() -> int:
+    # monotonic, so mark intervals are safe from wall clock jumps
+    return time.monotonic_ns() // 1_000_000
+
+
+def _serialize_frame(frame: Frame) -> str:
+    if isinstance(frame, str):
+        return frame
+    return orjson.dumps(frame).decode("utf-8")
+
+
+async def _send_text(websocket: WebSocket, text: str) -> None:
+    # send the asgi message directly rather than through send_text / send_json
+    await websocket.send({"type": "websocket.send", "text": text})
+
+
+async def _send_json(websocket: WebSocket, data: Union[dict, list]) -> None:
+    await _send_text(websocket, orjson.dumps(data).decode("utf-8"))
+
+
+def _join_audio_deltas(deltas: list[dict]) -> dict:
+    if len(deltas) == 1:
+        return deltas[0]
+    # padded base64 strings can't be concatenated, so join the raw audio
+    audio = b"".join(base64.b64decode(delta["delta"]) for delta in deltas)
+    return {
+        **deltas[0],
+        "delta": base64.b64encode(audio).decode("utf-8"),
+        "audio_ms": sum(delta["audio_ms"] for delta in deltas),
+    }
+
+
+def _merge_audio_deltas(messages: list[dict]) -> list[dict]:
+    """Merge contiguous audio deltas of the same item into one delta"""
+    merged: list[dict] = []
+    deltas: list[dict] = []
+    for message in messages:
+        if message["type"] == "response.audio.delta":
+            if deltas and deltas[0]["item_id"] != message["item_id"]:
+                merged.append(_join_audio_deltas(deltas))
+                deltas = []
+            deltas.append(message)
+            continue
+        if deltas:
+            merged.append(_join_audio_deltas(deltas))
+            deltas = []
+        merged.append(message)
+    if deltas:
+        merged.append(_join_audio_deltas(deltas))
+    return merged
+
+
+async def _receive_ready(
+    receive_stream: MemoryObjectReceiveStream[dict],
+    deadline: Optional[float],
+) -> Optional[dict]:
+    """Receive a message that is ready now or arrives before the deadline"""
+    try:
+        return receive_stream.receive_nowait()
+    except anyio.WouldBlock:
+        if deadline is None:
+            return None
+    with anyio.move_on_after(deadline - anyio.current_time()):
+        return await receive_stream.receive()
+    return None
+
+
+class _MessageRouter(ABC):
+    # one router lives per active call, keep instances free of a __dict__
+    __slots__ = (
+        "agent_id",
+        "organization_id",
+        "last_ai_item_id",
+        "mark_queue",
+        "mark_queue_elapsed_time",
+        "inter_mark_start_time",
+        "inter_mark_elapsed_time",
+        "ai_caller",
+        "_phone_call_id_str",
+        "_transfer_numbers_by_label",
+        "hang_up_reason",
+        "_background_tasks",
+        "_outbound_frames",
+        "_frame_stream",
+        "_ai_handlers",
+        "_function_handlers",
+        "_human_handlers",
+    )
+
     agent_id: SerializedUUID
     organization_id: str
-    from_phone_number: str
-    to_phone_number: str
-    stream_sid: Union[str, None]
     last_ai_item_id: Union[str, None]
-    mark_queue: list[int]
+    mark_queue: deque[int]
     mark_queue_elapsed_time: int
     inter_mark_start_time: Optional[int]
     hang_up_reason: Optional[HangUpReason]
-    call_type: PhoneCallType
 
     def __init__(
         self,
         agent_id: SerializedUUID,
         organization_id: str,
-        from_phone_number: str,
-        to_phone_number: str,
-        call_sid: str,
         ai_caller: AiCaller,
-        call_type: PhoneCallType,
     ):
         self.agent_id = agent_id
         self.organization_id = organization_id
-        self.from_phone_number = from_phone_number
-        self.to_phone_number = to_phone_number
-        self.call_sid = call_sid
-        self.stream_sid = None
         self.last_ai_item_id = None
-        self.mark_queue = []
+        self.mark_queue = deque()
         self.mark_queue_elapsed_time = 0
+        self.inter_mark_start_time = None
         self.inter_mark_elapsed_time = 0
         self.ai_caller = ai_caller
+        self._phone_call_id_str = str(ai_caller.phone_call_id)
+        self._transfer_numbers_by_label: dict[str, str] = {
+            item["label"]: item["phone_number"]
+            for item in ai_caller.tool_configuration.get(
+                "transfer_call_numbers", []
+            )
+        }
         self.hang_up_reason = None
-        self.call_type = call_type
-
-    async def _cleanup(self) -> None:
-        self.hang_up_reason = self.hang_up_reason or HangUpReason(
-            reason=PhoneCallEndReason.unknown,
-            data={},
+        # db writes kept off the message loop, flushed during cleanup
+        self._background_tasks: set[asyncio.Task] = set()
+        # frames produced while handling a message, flushed together
+        self._outbound_frames: list[Frame] = []
+        # handed to the websocket writer task while send_to_human runs
+        self._frame_stream: Optional[MemoryObjectSendStream[list[Frame]]] = (
+            None
         )
-        phone_call_id, duration = await self.ai_caller.close(
-            self.hang_up_reason.reason
-        )
-        if self.hang_up_reason.reason == PhoneCallEndReason.transferred:
-            transfer_call(self.call_sid, self.hang_up_reason.data["number"])
+
+        # dispatch tables, keyed on the event type / function name
+        self._ai_handlers: dict[str, MessageHandler] = {
+            "response.function_call_arguments.done": self._on_function_call,
+            "response.audio.delta": self._on_audio_delta,
+            "input_audio_buffer.speech_started": self._on_speech_started,
+        }
+        self._function_handlers: dict[str, FunctionHandler] = {
+            "hang_up": self._on_hang_up,
+            "cancel_hang_up": self._on_cancel_hang_up,
+            "query_documents": self._on_query_documents,
+            "send_text_message": self._on_send_text_message,
+            "transfer_call": self._on_transfer_call,
+            "enter_keypad": self._on_enter_keypad,
+        }
+        self._human_handlers: dict[str, MessageHandler] = {
+            "media": self._on_human_media,
+            "start": self._on_human_start,
+            "mark": self._on_human_mark,
+        }
+
+    @abstractmethod
+    async def _cleanup(self, websocket: WebSocket) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _send_text_message(
+        self, body: str, websocket: WebSocket
+    ) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _on_enter_keypad(
+        self, message: dict, arguments: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _on_audio_delta(
+        self, message: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _on_human_media(
+        self, message: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def _clear_frame(self) -> Frame:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _send_frames(
+        self, websocket: WebSocket, frames: list[Frame]
+    ) -> None:
+        raise NotImplementedError
+
+    async def _close_human_connection(self, websocket: WebSocket) -> None:
+        return None
+
+    def _queue_frame(self, frame: Frame) -> None:
+        self._outbound_frames.append(frame)
+
+    async def _flush_frames(self, websocket: WebSocket) -> None:
+        if not self._outbound_frames:
+            return
+        frames = self._outbound_frames
+        self._outbound_frames = []
+        if self._frame_stream is None:
+            await self._send_frames(websocket, frames)
         else:
-            hang_up_phone_call(self.call_sid)
-        logger.info("Cleanup complete")
+            await self._frame_stream.send(frames)
 
-        # twilio doesn't provide status callbacks for inbound calls
-        if self.call_type == PhoneCallType.inbound:
+    async def _write_frames(
+        self,
+        websocket: WebSocket,
+        receive_stream: MemoryObjectReceiveStream[list[Frame]],
+    ) -> None:
+        # closing the receive side on exit makes a stalled sender fail
+        # instead of blocking once the websocket is gone
+        async with receive_stream:
+            async for frames in receive_stream:
+                # coalesce batches that queued up while the socket was busy
+                while True:
+                    try:
+                        frames += receive_stream.receive_nowait()
+                    except (anyio.WouldBlock, anyio.EndOfStream):
+                        break
+                await self._send_frames(websocket, frames)
+
+    def _reset_ai_item(self, item_id: Optional[str]) -> None:
+        self.last_ai_item_id = item_id
+        self.mark_queue_elapsed_time = 0
+        self.inter_mark_start_time = None
+        self.mark_queue.clear()
+
+    def _track_audio_delta(self, item_id: str, audio_ms: int) -> None:
+        # the item id only goes back to None through _reset_ai_item, so the
+        # mark state is already clear on the first delta of an item
+        if self.last_ai_item_id is None:
+            self.last_ai_item_id = item_id
+        self.mark_queue.append(audio_ms)
+
+    def _run_in_background(self, coro: Coroutine) -> None:
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _flush_background_tasks(self) -> None:
+        if self._background_tasks:
+            await asyncio.gather(
+                *self._background_tasks, return_exceptions=True
+            )
+
+    async def _insert_outbound_text_message(
+        self,
+        from_phone_number: str,
+        to_phone_number: str,
+        body: str,
+        message_sid: str,
+    ) -> None:
+        try:
             async with async_session_scope() as db:
-                await insert_phone_call_event(
-                    phone_call_id,
-                    {
-                        "CallDuration": duration // 1000,
-                        "CallStatus": PhoneCallStatus.completed,
-                        "SequenceNumber": 1,
-                    },
+                await insert_text_message(
+                    self.agent_id,
+                    from_phone_number,
+                    to_phone_number,
+                    body,
+                    TextMessageType.outbound,
+                    message_sid,
+                    self._phone_call_id_str,
+                    self.organization_id,
                     db,
                 )
+        except Exception:
+            logger.exception("Error inserting text message")
 
-    async def _send_text_message(self, body: str) -> None:
-        message_id = str(uuid.uuid4())
-        sending_phone_number = (
-            self.from_phone_number
-            if self.call_type == PhoneCallType.outbound
-            else self.to_phone_number
-        )
-        receiving_phone_number = (
-            self.to_phone_number
-            if self.call_type == PhoneCallType.outbound
-            else self.from_phone_number
+    async def _end_on_user_hangup(self) -> None:
+        self.hang_up_reason = HangUpReason(
+            reason=PhoneCallEndReason.user_hangup,
+            data={},
         )
+        await self._truncate_audio_message()
 
-        output_sid = send_text_message(
-            receiving_phone_number,
-            body,
-            sending_phone_number,
-            f"https://{settings.host}/api/v1/phone/webhook/text-message-status/{message_id}",
-        )
+    async def _insert_completed_call_event(
+        self, phone_call_id: SerializedUUID, duration: int
+    ) -> None:
         async with async_session_scope() as db:
-            await insert_text_message(
-                self.agent_id,
-                sending_phone_number,
-                receiving_phone_number,
-                body,
-                TextMessageType.outbound,
-                output_sid,
-                str(self.ai_caller.phone_call_id),
-                self.organization_id,
+            await insert_phone_call_event(
+                phone_call_id,
+                {
+                    "CallDuration": duration // 1000,
+                    "CallStatus": PhoneCallStatus.completed,
+                    "SequenceNumber": 1,
+                },
                 db,
             )
 
+    async def _on_function_call(
+        self, message: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        handler = self._function_handlers.get(message["name"])
+        if handler is None:
+            logger.warning(
+                f"Received unexpected function call: {message['name']}"
+            )
+            return None
+        # parsed once here and shared with the handler
+        raw_arguments = message.get("arguments")
+        arguments = orjson.loads(raw_arguments) if raw_arguments else {}
+        return await handler(message, arguments, websocket)
+
+    async def _on_hang_up(
+        self, message: dict, arguments: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        if arguments.get("reason") == "answering_machine":
+            self.hang_up_reason = HangUpReason(
+                reason=PhoneCallEndReason.voice_mail_bot,
+                data={},
+            )
+            logger.info("Answering machine detected, not leaving a message")
+            return True
+        else:
+            self.hang_up_reason = HangUpReason(
+                reason=PhoneCallEndReason.end_of_call_bot,
+                data={},
+            )
+            logger.info("Hang up requested by bot")
+            return None
+
+    async def _on_cancel_hang_up(
+        self, message: dict, arguments: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        self.hang_up_reason = None
+        logger.info("Hang up cancelled")
+        return None
+
+    async def _on_query_documents(
+        self, message: dict, arguments: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        query = arguments["query"]
+        try:
+            documents = await query_documents(
+                query,
+                self.ai_caller.tool_configuration.get("knowledge_bases", []),
+            )
+        except Exception:
+            # a failed lookup is reported to the model instead of ending the
+            # call
+            logger.exception("Error querying documents")
+            documents = "The documents could not be searched"
+        await self.ai_caller.receive_tool_call_result(
+            message["item_id"],
+            message["call_id"],
+            documents,
+        )
+        return None
+
+    async def _on_send_text_message(
+        self, message: dict, arguments: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        await self._send_text_message(arguments["message"], websocket)
+        return None
+
+    async def _on_transfer_call(
+        self, message: dict, arguments: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        await self._transfer_call(arguments["phone_number_label"])
+        return None
+
     async def _transfer_call(self, phone_number_label: str) -> None:
-        transfer_call_number: Optional[str] = next(
-            (
-                item["phone_number"]
-                for item in self.ai_caller.tool_configuration[
-                    "transfer_call_numbers"
-                ]
-                if item["label"] == phone_number_label
-            ),
-            None,
+        transfer_call_number = self._transfer_numbers_by_label.get(
+            phone_number_label
         )
         if transfer_call_number is None:
             logger.warning(
@@ -156,481 +447,552 @@ class CallRouter:
                 data={"number": transfer_call_number},
             )
 
+    async def _on_speech_started(
+        self, message: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        await self.handle_speech_started(websocket)
+        return None
+
+    async def _produce_ai_messages(
+        self, send_stream: MemoryObjectSendStream[dict]
+    ) -> None:
+        # closing the stream signals the end of the ai messages
+        async with send_stream:
+            async for message in self.ai_caller:
+                await send_stream.send(message)
+
+    async def _next_ai_batch(
+        self, receive_stream: MemoryObjectReceiveStream[dict]
+    ) -> tuple[list[dict], bool]:
+        """
+        Wait for the next ai message, then drain any messages that are
+        already available, or that arrive within the coalescing window
+        when the batch starts with audio, returns the batch and whether the
+        stream ended
+        """
+        try:
+            message = await receive_stream.receive()
+        except anyio.EndOfStream:
+            return [], True
+        batch = [message]
+        batch_audio_ms = message.get("audio_ms", 0)
+        coalesce_deadline = (
+            anyio.current_time() + AUDIO_COALESCE_SECONDS
+            if message["type"] == "response.audio.delta"
+            else None
+        )
+        while (
+            len(batch) < MAX_BATCH_MESSAGES
+            and batch_audio_ms < MAX_BATCH_AUDIO_MS
+            # flush right away on barge in
+            and message["type"] != "input_audio_buffer.speech_started"
+        ):
+            try:
+                message = await _receive_ready(
+                    receive_stream, coalesce_deadline
+                )
+            except anyio.EndOfStream:
+                return _merge_audio_deltas(batch), True
+            if message is None:
+                break
+            batch.append(message)
+            batch_audio_ms += message.get("audio_ms", 0)
+        return _merge_audio_deltas(batch), False
+
     async def send_to_human(self, websocket: WebSocket):
+        send_stream, receive_stream = anyio.create_memory_object_stream[dict](
+            AI_STREAM_CAPACITY
+        )
+        # the producer runs as a separate task so the ai connection keeps
+        # being read while frames are written to the websocket
+        producer = asyncio.create_task(self._produce_ai_messages(send_stream))
+        # a single writer owns the websocket so a slow socket does not hold
+        # up message handling
+        frame_send_stream, frame_receive_stream = (
+            anyio.create_memory_object_stream[list[Frame]](
+                FRAME_STREAM_CAPACITY
+            )
+        )
+        self._frame_stream = frame_send_stream
+        writer = asyncio.create_task(
+            self._write_frames(websocket, frame_receive_stream)
+        )
+        # bound once, these are looked up for every ai message
+        next_ai_batch = self._next_ai_batch
+        get_handler = self._ai_handlers.get
+        flush_frames = self._flush_frames
         try:
-            async for message in self.ai_caller:
-                if message["type"] == "response.function_call_arguments.done":
-                    if message["name"] == "hang_up":
-                        arguments = json.loads(message["arguments"])
-                        if arguments["reason"] == "answering_machine":
-                            self.hang_up_reason = HangUpReason(
-                                reason=PhoneCallEndReason.voice_mail_bot,
-                                data={},
-                            )
-                            logger.info(
-                                "Answering machine detected, not leaving a message"
-                            )
-                            break
-                        else:
-                            self.hang_up_reason = HangUpReason(
-                                reason=PhoneCallEndReason.end_of_call_bot,
-                                data={},
-                            )
-                            logger.info("Hang up requested by bot")
-                    elif message["name"] == "cancel_hang_up":
-                        self.hang_up_reason = None
-                        logger.info("Hang up cancelled")
-                    elif message["name"] == "query_documents":
-                        arguments = json.loads(message["arguments"])
-                        query = arguments["query"]
-                        documents = await query_documents(
-                            query,
-                            self.ai_caller.tool_configuration.get(
-                                "knowledge_bases", []
-                            ),
-                        )
-                        await self.ai_caller.receive_tool_call_result(
-                            message["item_id"],
-                            message["call_id"],
-                            documents,
-                        )
-                    elif message["name"] == "send_text_message":
-                        arguments = json.loads(message["arguments"])
-                        await self._send_text_message(
-                            arguments["message"],
-                        )
-                    elif message["name"] == "transfer_call":
-                        arguments = json.loads(message["arguments"])
-                        await self._transfer_call(
-                            arguments["phone_number_label"]
-                        )
-                    elif message["name"] == "enter_keypad":
-                        arguments = json.loads(message["arguments"])
-                        send_digits(self.call_sid, arguments["digits"])
-                    else:
-                        logger.warning(
-                            f"Received unexpected function call: {message['name']}"
-                        )
-
-                if message["type"] == "response.audio.delta":
-                    audio_delta = {
-                        "event": "media",
-                        "streamSid": self.stream_sid,
-                        "media": {
-                            "payload": message["delta"],
-                        },
-                    }
-                    await websocket.send_json(audio_delta)
-
-                    if self.last_ai_item_id is None:
-                        self.last_ai_item_id = message["item_id"]
-                        self.mark_queue_elapsed_time = 0
-                        self.inter_mark_start_time = None
-                        self.mark_queue.clear()
-
-                    if self.stream_sid is not None:
-                        mark_event = {
-                            "event": "mark",
-                            "streamSid": self.stream_sid,
-                            "mark": {"name": "responsePart"},
-                        }
-                        await websocket.send_json(mark_event)
-                        self.mark_queue.append(message["audio_ms"])
-
-                if message["type"] == "input_audio_buffer.speech_started":
-                    await self.handle_speech_started(websocket)
+            stream_ended = False
+            stop = False
+            while not stream_ended and not stop:
+                batch, stream_ended = await next_ai_batch(receive_stream)
+                for message in batch:
+                    message_type = message["type"]
+                    handler = get_handler(message_type)
+                    if handler is None:
+                        continue
+                    if message_type != "response.audio.delta":
+                        # audio queued so far is not held up by a handler
+                        # that waits on the network
+                        await flush_frames(websocket)
+                    if await handler(message, websocket):
+                        stop = True
+                        break
+                await flush_frames(websocket)
+            if stream_ended:
+                # surface any error from the ai connection
+                await producer
+        except anyio.BrokenResourceError:
+            # the writer stopped, its error is surfaced below
+            pass
         except WebSocketDisconnect:
             logger.info("Connection closed")
         except Exception:
             logger.exception("Error sending to human")
         finally:
-            await self._cleanup()
+            producer.cancel()
+            receive_stream.close()
+            # let the writer drain what was already flushed
+            self._frame_stream = None
+            frame_send_stream.close()
+            await self._await_writer(writer)
+            # let the human side see the close before the slower cleanup
+            await self._close_human_connection(websocket)
+
+    async def _await_writer(self, writer: asyncio.Task) -> None:
+        try:
+            await writer
+        except WebSocketDisconnect:
+            logger.info("Connection closed")
+        except Exception:
+            logger.exception("Error sending to human")
 
     async def _truncate_audio_message(self) -> None:
         if self.last_ai_item_id is not None:
             if self.inter_mark_start_time is not None:
                 self.inter_mark_elapsed_time = (
-                    int(time.time() * 1000) - self.inter_mark_start_time
+                    _now_ms() - self.inter_mark_start_time
+                )
+                first_mark_ms = (
+                    self.mark_queue[0]
+                    if self.mark_queue
+                    else self.inter_mark_elapsed_time
                 )
                 self.mark_queue_elapsed_time += min(
-                    self.inter_mark_elapsed_time,
-                    (
-                        self.mark_queue[0]
-                        if len(self.mark_queue) > 0
-                        else self.inter_mark_elapsed_time
-                    ),
+                    self.inter_mark_elapsed_time, first_mark_ms
                 )
             await self.ai_caller.truncate_message(
                 self.last_ai_item_id, self.mark_queue_elapsed_time
             )
 
     async def handle_speech_started(self, websocket: WebSocket):
-        if len(self.mark_queue) > 0:
+        if self.mark_queue:
+            # hand the clear to the writer before the truncate round trip so
+            # the human stops hearing audio without waiting on the ai
+            self._queue_frame(self._clear_frame())
+            await self._flush_frames(websocket)
             await self._truncate_audio_message()
-            await websocket.send_json(
-                {"event": "clear", "streamSid": self.stream_sid}
-            )
-
-            self.mark_queue.clear()
-        self.last_ai_item_id = None
-        self.mark_queue_elapsed_time = 0
-        self.inter_mark_start_time = None
+        self._reset_ai_item(None)
+
+    async def _on_human_start(
+        self, data: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        self._reset_ai_item(None)
+        return None
+
+    async def _on_human_mark(
+        self, data: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        if self.mark_queue:
+            time_ms = self.mark_queue.popleft()
+            self.mark_queue_elapsed_time += time_ms
+            remaining = len(self.mark_queue)
+            self.inter_mark_start_time = _now_ms() if remaining else None
+            if self.hang_up_reason is not None and not remaining:
+                logger.info("Hang up requested and all media processed")
+                return True
+        return None
+
+    @abstractmethod
+    async def _on_human_connection_closed(self) -> None:
+        raise NotImplementedError
 
     async def receive_from_human_call(self, websocket: WebSocket):
+        # bound once, these are looked up for every inbound audio frame
+        search_payload = MEDIA_PAYLOAD_RE.search
+        receive_human_audio = self.ai_caller.receive_human_audio
+        get_handler = self._human_handlers.get
+        # read raw asgi messages rather than through iter_text, mirroring
+        # how frames are sent
+        receive = websocket.receive
         try:
-            async for message in websocket.iter_text():
-                data = json.loads(message)
-                if data["event"] == "media":
-                    await self.ai_caller.receive_human_audio(
-                        data["media"]["payload"]
-                    )
-                elif data["event"] == "start":
-                    self.stream_sid = data["start"]["streamSid"]
-                    self.last_ai_item_id = None
-                    self.mark_queue_elapsed_time = 0
-                    self.mark_queue.clear()
-                elif data["event"] == "mark":
-                    if self.mark_queue:
-                        time_ms = self.mark_queue.pop(0)
-                        self.mark_queue_elapsed_time += time_ms
-                        self.inter_mark_start_time = (
-                            int(time.time() * 1000)
-                            if len(self.mark_queue) > 0
-                            else None
-                        )
-                        if (
-                            self.hang_up_reason is not None
-                            and len(self.mark_queue) == 0
-                        ):
-                            logger.info(
-                                "Hang up requested and all media processed"
-                            )
-                            break
+            while True:
+                frame = await receive()
+                if frame["type"] == "websocket.disconnect":
+                    break
+                message = frame.get("text")
+                if message is None:
+                    # both clients only send text frames
+                    continue
+                if message.startswith(MEDIA_FRAME_PREFIX):
+                    match = search_payload(message)
+                    if match is not None:
+                        await receive_human_audio(match.group(1))
+                        continue
+                data = orjson.loads(message)
+                handler = get_handler(data["event"])
+                if handler is not None and await handler(data, websocket):
+                    break
         except websockets.exceptions.ConnectionClosedOK:
             logger.info("Connection closed")
-            self.hang_up_reason = HangUpReason(
-                reason=PhoneCallEndReason.user_hangup,
-                data={},
-            )
-            await self._truncate_audio_message()
+            await self._on_human_connection_closed()
         except Exception:
             logger.exception("Error receiving from human")
+
+    async def run(self, websocket: WebSocket) -> None:
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                receive_task = task_group.create_task(
+                    self.receive_from_human_call(websocket)
+                )
+                send_task = task_group.create_task(
+                    self.send_to_human(websocket)
+                )
+                # whichever side finishes first ends the call
+                await asyncio.wait(
+                    (receive_task, send_task),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                receive_task.cancel()
+                send_task.cancel()
         finally:
-            await self._cleanup()
+            # both sides have stopped, so cleanup runs exactly once, even
+            # when the endpoint is cancelled or a side fails
+            await self._cleanup(websocket)
 
 
-class BrowserRouter:
-    agent_id: SerializedUUID
-    organization_id: str
-    last_ai_item_id: Union[str, None]
-    mark_queue: list[int]
-    mark_queue_elapsed_time: int
-    inter_mark_start_time: Optional[int]
-    hang_up_reason: Optional[HangUpReason]
+class CallRouter(_MessageRouter):
+    __slots__ = (
+        "from_phone_number",
+        "to_phone_number",
+        "call_sid",
+        "stream_sid",
+        "_mark_frame",
+        "_media_frame_prefix",
+        "_clear_frame_text",
+        "call_type",
+    )
+
+    from_phone_number: str
+    to_phone_number: str
+    stream_sid: Union[str, None]
+    call_type: PhoneCallType
 
     def __init__(
         self,
         agent_id: SerializedUUID,
         organization_id: str,
+        from_phone_number: str,
+        to_phone_number: str,
+        call_sid: str,
         ai_caller: AiCaller,
+        call_type: PhoneCallType,
     ):
-        self.agent_id = agent_id
-        self.organization_id = organization_id
-        self.last_ai_item_id = None
-        self.mark_queue = []
-        self.mark_queue_elapsed_time = 0
-        self.ai_caller = ai_caller
-        self.hang_up_reason = None
-        self._cleanup_started = False
+        super().__init__(agent_id, organization_id, ai_caller)
+        self.from_phone_number = from_phone_number
+        self.to_phone_number = to_phone_number
+        self.call_sid = call_sid
+        self.stream_sid = None
+        self._mark_frame: Optional[str] = None
+        self._media_frame_prefix = ""
+        self._clear_frame_text: Optional[str] = None
+        self.call_type = call_type
 
     async def _cleanup(self, websocket: WebSocket) -> None:
-        if self._cleanup_started:
-            logger.info("Cleanup already started")
-            return
-        self._cleanup_started = True
+        await self._flush_background_tasks()
         self.hang_up_reason = self.hang_up_reason or HangUpReason(
             reason=PhoneCallEndReason.unknown,
             data={},
         )
-        if (
-            self.hang_up_reason.reason == PhoneCallEndReason.transferred
-            and websocket.client_state == WebSocketState.CONNECTED
-        ):
-            await websocket.send_json(
+        phone_call_id, duration = await self.ai_caller.close(
+            self.hang_up_reason.reason
+        )
+        if self.hang_up_reason.reason == PhoneCallEndReason.transferred:
+            transfer_call(self.call_sid, self.hang_up_reason.data["number"])
+        else:
+            await hang_up_phone_call(self.call_sid)
+        logger.info("Cleanup complete")
+
+        # twilio doesn't provide status callbacks for inbound calls
+        if self.call_type == PhoneCallType.inbound:
+            await self._insert_completed_call_event(phone_call_id, duration)
+
+    async def _send_text_message(
+        self, body: str, websocket: WebSocket
+    ) -> None:
+        message_id = uuid.uuid4().hex
+        sending_phone_number = (
+            self.from_phone_number
+            if self.call_type == PhoneCallType.outbound
+            else self.to_phone_number
+        )
+        receiving_phone_number = (
+            self.to_phone_number
+            if self.call_type == PhoneCallType.outbound
+            else self.from_phone_number
+        )
+
+        output_sid = send_text_message(
+            receiving_phone_number,
+            body,
+            sending_phone_number,
+            f"https://{settings.host}/api/v1/phone/webhook/text-message-status/{message_id}",
+        )
+        self._run_in_background(
+            self._insert_outbound_text_message(
+                sending_phone_number,
+                receiving_phone_number,
+                body,
+                output_sid,
+            )
+        )
+
+    async def _on_enter_keypad(
+        self, message: dict, arguments: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        send_digits(self.call_sid, arguments["digits"])
+        return None
+
+    async def _on_audio_delta(
+        self, message: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        mark_frame = self._mark_frame
+        if mark_frame is not None:
+            queue_frame = self._queue_frame
+            # base64 needs no json escaping, so splice it into the template
+            queue_frame(self._media_frame_prefix + message["delta"] + '"}}')
+            queue_frame(mark_frame)
+            self._track_audio_delta(message["item_id"], message["audio_ms"])
+        else:
+            self._queue_frame(
                 {
-                    "event": "message",
-                    "payload": {
-                        "title": "Call Transfer",
-                        "body": f"Call would be transferred to {self.hang_up_reason.data['number']}",
+                    "event": "media",
+                    "streamSid": self.stream_sid,
+                    "media": {
+                        "payload": message["delta"],
                     },
                 }
             )
+            if self.last_ai_item_id is None:
+                self.last_ai_item_id = message["item_id"]
+        return None
+
+    def _clear_frame(self) -> Frame:
+        if self._clear_frame_text is not None:
+            return self._clear_frame_text
+        return {"event": "clear", "streamSid": self.stream_sid}
+
+    async def _send_frames(
+        self, websocket: WebSocket, frames: list[Frame]
+    ) -> None:
+        # twilio media streams only accept a single event per message
+        for frame in frames:
+            await _send_text(websocket, _serialize_frame(frame))
+
+    async def _on_human_media(
+        self, data: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        await self.ai_caller.receive_human_audio(data["media"]["payload"])
+        return None
+
+    async def _on_human_start(
+        self, data: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        self.stream_sid = data["start"]["streamSid"]
+        # the mark and clear frames only depend on the stream, so serialize
+        # them once, along with the head of every media frame
+        self._media_frame_prefix = (
+            '{"event":"media","streamSid":'
+            + orjson.dumps(self.stream_sid).decode("utf-8")
+            + ',"media":{"payload":"'
+        )
+        self._mark_frame = orjson.dumps(
+            {
+                "event": "mark",
+                "streamSid": self.stream_sid,
+                "mark": {"name": "responsePart"},
+            }
+        ).decode("utf-8")
+        self._clear_frame_text = orjson.dumps(
+            {"event": "clear", "streamSid": self.stream_sid}
+        ).decode("utf-8")
+        return await super()._on_human_start(data, websocket)
+
+    async def _on_human_connection_closed(self) -> None:
+        await self._end_on_user_hangup()
 
+
+class BrowserRouter(_MessageRouter):
+    __slots__ = ()
+
+    def __init__(
+        self,
+        agent_id: SerializedUUID,
+        organization_id: str,
+        ai_caller: AiCaller,
+    ):
+        super().__init__(agent_id, organization_id, ai_caller)
+        self._ai_handlers["response.audio_transcript.done"] = (
+            self._on_speaker_segments
+        )
+        self._ai_handlers[
+            "conversation.item.input_audio_transcription.completed"
+        ] = self._on_speaker_segments
+        self._human_handlers["hangup"] = self._on_human_hangup
+
+    async def _cleanup(self, websocket: WebSocket) -> None:
+        await self._flush_background_tasks()
+        self.hang_up_reason = self.hang_up_reason or HangUpReason(
+            reason=PhoneCallEndReason.unknown,
+            data={},
+        )
         phone_call_id, duration = await self.ai_caller.close(
             self.hang_up_reason.reason
             if self.hang_up_reason is not None
             else PhoneCallEndReason.unknown
         )
-        async with async_session_scope() as db:
-            await insert_phone_call_event(
-                phone_call_id,
-                {
-                    "CallDuration": duration // 1000,
-                    "CallStatus": PhoneCallStatus.completed,
-                    "SequenceNumber": 1,
-                },
-                db,
-            )
+        await self._insert_completed_call_event(phone_call_id, duration)
 
     async def _send_text_message(
         self, body: str, websocket: WebSocket
     ) -> None:
-        await websocket.send_json(
+        self._queue_frame(
             {
                 "event": "message",
                 "payload": {"title": "SMS Message", "body": body},
             }
         )
-        async with async_session_scope() as db:
-            await insert_text_message(
-                self.agent_id,
-                BROWSER_NAME,
-                BROWSER_NAME,
-                body,
-                TextMessageType.outbound,
-                "no-sid",
-                str(self.ai_caller.phone_call_id),
-                self.organization_id,
-                db,
+        self._run_in_background(
+            self._insert_outbound_text_message(
+                BROWSER_NAME, BROWSER_NAME, body, "no-sid"
             )
-
-    async def _transfer_call(
-        self, phone_number_label: str, websocket: WebSocket
-    ) -> None:
-        transfer_call_number: Optional[str] = next(
-            (
-                item["phone_number"]
-                for item in self.ai_caller.tool_configuration[
-                    "transfer_call_numbers"
-                ]
-                if item["label"] == phone_number_label
-            ),
-            None,
         )
-        if transfer_call_number is None:
-            logger.warning(
-                f"Transfer call number not found: {phone_number_label}, call will not be transferred"
-            )
-        else:
-            self.hang_up_reason = HangUpReason(
-                reason=PhoneCallEndReason.transferred,
-                data={"number": transfer_call_number},
-            )
 
-    async def send_to_human(self, websocket: WebSocket):
-        try:
-            async for message in self.ai_caller:
-                if message["type"] == "response.function_call_arguments.done":
-                    if message["name"] == "hang_up":
-                        hang_up_sound = get_sound_base64("hang_up_sound_24k")
-                        if hang_up_sound is not None:
-                            await websocket.send_json(
-                                {
-                                    "event": "media",
-                                    "payload": hang_up_sound[0],
-                                }
-                            )
-                            self.mark_queue.append(hang_up_sound[1])
-                        else:
-                            logger.warning("Hang up sound not found")
-                        arguments = json.loads(message["arguments"])
-                        if arguments["reason"] == "answering_machine":
-                            self.hang_up_reason = HangUpReason(
-                                reason=PhoneCallEndReason.voice_mail_bot,
-                                data={},
-                            )
-                            logger.info(
-                                "Answering machine detected, not leaving a message"
-                            )
-                        else:
-                            self.hang_up_reason = HangUpReason(
-                                reason=PhoneCallEndReason.end_of_call_bot,
-                                data={},
-                            )
-                            logger.info("Hang up requested by bot")
-                    elif message["name"] == "cancel_hang_up":
-                        self.hang_up_reason = None
-                        logger.info("Hang up cancelled")
-                    elif message["name"] == "query_documents":
-                        arguments = json.loads(message["arguments"])
-                        query = arguments["query"]
-                        documents = await query_documents(
-                            query,
-                            self.ai_caller.tool_configuration.get(
-                                "knowledge_bases", []
-                            ),
-                        )
-                        await self.ai_caller.receive_tool_call_result(
-                            message["item_id"],
-                            message["call_id"],
-                            documents,
-                        )
-                    elif message["name"] == "send_text_message":
-                        arguments = json.loads(message["arguments"])
-                        await self._send_text_message(
-                            arguments["message"],
-                            websocket,
-                        )
-                    elif message["name"] == "transfer_call":
-                        arguments = json.loads(message["arguments"])
-                        await self._transfer_call(
-                            arguments["phone_number_label"], websocket
-                        )
-                    elif message["name"] == "enter_keypad":
-                        arguments = json.loads(message["arguments"])
-                        await websocket.send_json(
-                            {
-                                "event": "message",
-                                "payload": {
-                                    "title": "Keypad",
-                                    "body": arguments["digits"],
-                                },
-                            }
-                        )
-                    else:
-                        logger.warning(
-                            f"Received unexpected function call: {message['name']}"
-                        )
-
-                elif message["type"] == "response.audio.delta":
-                    await websocket.send_json(
-                        {"event": "media", "payload": message["delta"]}
-                    )
-
-                    if self.last_ai_item_id is None:
-                        self.last_ai_item_id = message["item_id"]
-                        self.mark_queue_elapsed_time = 0
-                        self.inter_mark_start_time = None
-                        self.mark_queue.clear()
-                    self.mark_queue.append(message["audio_ms"])
-
-                elif message["type"] == "input_audio_buffer.speech_started":
-                    await self.handle_speech_started(websocket)
+    async def _on_hang_up(
+        self, message: dict, arguments: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        hang_up_sound = get_sound_media_frame("hang_up_sound_24k")
+        if hang_up_sound is not None:
+            self._queue_frame(hang_up_sound[0])
+            self.mark_queue.append(hang_up_sound[1])
+        else:
+            logger.warning("Hang up sound not found")
+        # the browser plays out the hang up sound before the call ends
+        await super()._on_hang_up(message, arguments, websocket)
+        return None
+
+    async def _on_enter_keypad(
+        self, message: dict, arguments: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        self._queue_frame(
+            {
+                "event": "message",
+                "payload": {
+                    "title": "Keypad",
+                    "body": arguments["digits"],
+                },
+            }
+        )
+        return None
 
-                elif message["type"] == "response.audio_transcript.done":
-                    await websocket.send_json(
+    async def _on_audio_delta(
+        self, message: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        self._queue_frame(
+            '{"event":"media","payload":"' + message["delta"] + '"}'
+        )
+        self._track_audio_delta(message["item_id"], message["audio_ms"])
+        return None
+
+    async def _on_speaker_segments(
+        self, message: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        self._queue_frame(
+            '{"event":"speaker_segments","payload":'
+            + message["speaker_segments_json"]
+            + "}"
+        )
+        return None
+
+    async def _close_human_connection(self, websocket: WebSocket) -> None:
+        if websocket.client_state == WebSocketState.CONNECTED:
+            try:
+                if (
+                    self.hang_up_reason is not None
+                    and self.hang_up_reason.reason
+                    == PhoneCallEndReason.transferred
+                ):
+                    await _send_json(
+                        websocket,
                         {
-                            "event": "speaker_segments",
-                            "payload": jsonable_encoder(
-                                message["speaker_segments"]
-                            ),
+                            "event": "message",
+                            "payload": {
+                                "title": "Call Transfer",
+                                "body": f"Call would be transferred to {self.hang_up_reason.data['number']}",
+                            },
                         },
                     )
-                elif (
-                    message["type"]
-                    == "conversation.item.input_audio_transcription.completed"
+                await websocket.close()
+            except RuntimeError as e:
+                if (
+                    "Cannot call 'send' once a close message has been sent"
+                    in str(e)
                 ):
-                    await websocket.send_json(
-                        {
-                            "event": "speaker_segments",
-                            "payload": jsonable_encoder(
-                                message["speaker_segments"]
-                            ),
-                        }
-                    )
-        except WebSocketDisconnect:
-            logger.info("Connection closed")
-        except Exception:
-            logger.exception("Error sending to human")
-        finally:
-            await self._cleanup(websocket)
-            if websocket.client_state == WebSocketState.CONNECTED:
-                try:
-                    await websocket.close()
-                except RuntimeError as e:
-                    if (
-                        "Cannot call 'send' once a close message has been sent"
-                        in str(e)
-                    ):
-                        logger.info("Connection already closed")
-                    else:
-                        logger.exception("Error closing websocket")
-            logger.info("Closed connection to human")
+                    logger.info("Connection already closed")
+                else:
+                    logger.exception("Error closing websocket")
+        logger.info("Closed connection to human")
 
-    async def _truncate_audio_message(self) -> None:
-        if self.last_ai_item_id is not None:
-            if self.inter_mark_start_time is not None:
-                self.inter_mark_elapsed_time = (
-                    int(time.time() * 1000) - self.inter_mark_start_time
-                )
-                self.mark_queue_elapsed_time += min(
-                    self.inter_mark_elapsed_time,
-                    (
-                        self.mark_queue[0]
-                        if len(self.mark_queue) > 0
-                        else self.inter_mark_elapsed_time
-                    ),
-                )
-            await self.ai_caller.truncate_message(
-                self.last_ai_item_id, self.mark_queue_elapsed_time
-            )
+    def _clear_frame(self) -> Frame:
+        return CLEAR_FRAME
 
-    async def handle_speech_started(self, websocket: WebSocket):
-        if len(self.mark_queue) > 0:
-            await self._truncate_audio_message()
-            await websocket.send_json({"event": "clear"})
+    async def _send_frames(
+        self, websocket: WebSocket, frames: list[Frame]
+    ) -> None:
+        # the browser client accepts a json array of events in one message
+        if len(frames) == 1:
+            await _send_text(websocket, _serialize_frame(frames[0]))
+        else:
+            await _send_text(
+                websocket,
+                "["
+                + ",".join(_serialize_frame(frame) for frame in frames)
+                + "]",
+            )
 
-            self.mark_queue.clear()
-        self.last_ai_item_id = None
-        self.mark_queue_elapsed_time = 0
-        self.inter_mark_start_time = None
+    async def _on_human_media(
+        self, data: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        await self.ai_caller.receive_human_audio(data["payload"])
+        return None
+
+    async def _on_human_start(
+        self, data: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        logger.info("Incoming stream has started")
+        return await super()._on_human_start(data, websocket)
+
+    async def _on_human_hangup(
+        self, data: dict, websocket: WebSocket
+    ) -> Optional[bool]:
+        logger.info("Hang up requested by user")
+        await self._end_on_user_hangup()
+        return True
+
+    async def _on_human_connection_closed(self) -> None:
+        if self.hang_up_reason is None:
+            await self._end_on_user_hangup()
 
     async def receive_from_human_call(self, websocket: WebSocket):
-        try:
-            async for message in websocket.iter_text():
-                data = json.loads(message)
-                if data["event"] == "media":
-                    await self.ai_caller.receive_human_audio(data["payload"])
-                elif data["event"] == "start":
-                    logger.info("Incoming stream has started")
-                    self.last_ai_item_id = None
-                    self.mark_queue_elapsed_time = 0
-                    self.mark_queue.clear()
-                elif data["event"] == "mark":
-                    if self.mark_queue:
-                        time_ms = self.mark_queue.pop(0)
-                        self.mark_queue_elapsed_time += time_ms
-                        self.inter_mark_start_time = (
-                            int(time.time() * 1000)
-                            if len(self.mark_queue) > 0
-                            else None
-                        )
-                        if (
-                            self.hang_up_reason is not None
-                            and len(self.mark_queue) == 0
-                        ):
-                            logger.info(
-                                "Hang up requested and all media processed"
-                            )
-                            break
-                elif data["event"] == "hangup":
-                    logger.info("Hang up requested by user")
-                    self.hang_up_reason = HangUpReason(
-                        reason=PhoneCallEndReason.user_hangup,
-                        data={},
-                    )
-                    await self._truncate_audio_message()
-                    break
-        except websockets.exceptions.ConnectionClosedOK:
-            logger.info("Connection closed")
-            if self.hang_up_reason is None:
-                self.hang_up_reason = HangUpReason(
-                    reason=PhoneCallEndReason.user_hangup,
-                    data={},
-                )
-                await self._truncate_audio_message()
-        except Exception:
-            logger.exception("Error receiving from human")
-        finally:
-            await self._cleanup(websocket)
-            logger.info("Closed connection to bot")
+        await super().receive_from_human_call(websocket)
+        logger.info("Closed connection to bot")
@@ -1,205 +1,297 @@
-import base64
-import io
-import json
+import binascii
 import logging
-import wave
-from typing import Optional
+import struct
+from typing import IO, Callable, Optional
 
 import numpy as np
+import orjson
 
 from src.helixion_types import BarHeight, Speaker, SpeakerSegment
 
 logger = logging.getLogger(__name__)
 
 
-def process_audio_data(
-    file_bytes: bytes,
-    sample_rate: int,
-) -> tuple[list[SpeakerSegment], bytearray]:
-    bytes_per_sample = 1 if sample_rate == 8000 else 2
-    file_str = file_bytes.decode("utf-8")
-    speaker_segments: list[SpeakerSegment] = []
-    total_ms = 0
-    input_data_ms = 300
-    user_speaking = False
-    input_buffer_data: list[tuple[bytes, float]] = []
-    audio_data: list[tuple[bytes, float, float, Optional[str]]] = (
-        []
-    )  # audio bytes, timestamp within item, item id
-    segment_indices_to_remove = set()
-    input_item_time_elapsed = 0
-    output_item_time_elapsed = 0
-    for line in file_str.splitlines():
-        # exlcude timestamp
-        line_data = json.loads(line.split("]", 1)[1].strip())
-        if line_data["type"] == "input_audio_buffer.speech_started":
-            output_item_time_elapsed = 0
-            user_speaking = True
-            speaker_segments.append(
-                SpeakerSegment(
-                    timestamp=total_ms / 1000,
-                    speaker=Speaker.user,
-                    transcript="",
-                    item_id=line_data["item_id"],
-                )
-            )
-            audio_start_ms = line_data["audio_start_ms"]
-            for decoded_data, ms in input_buffer_data:
-                if ms >= audio_start_ms:
-                    segment_ms = (
-                        (len(decoded_data) / bytes_per_sample)
-                        * 1000.0
-                        / sample_rate
-                    )
-                    input_item_time_elapsed += segment_ms
-                    audio_data.append(
-                        (
-                            decoded_data,
-                            segment_ms,
-                            input_item_time_elapsed,
-                            None,
-                        )
-                    )
-                    total_ms += segment_ms
-
-        elif (
-            line_data["type"]
-            == "conversation.item.input_audio_transcription.completed"
-        ):
-            item_id = line_data["item_id"]
-            for segment in speaker_segments:
-                if segment.item_id == item_id:
-                    if segment.speaker != Speaker.user:
-                        logger.exception("Matching segment is not the user")
-                    else:
-                        segment.transcript = line_data["transcript"]
-                        break
-
-        elif line_data["type"] == "input_audio_buffer.speech_stopped":
-            user_speaking = False
-            input_item_time_elapsed = 0
-            speaker_segments.append(
-                SpeakerSegment(
-                    timestamp=total_ms / 1000,
-                    speaker=Speaker.assistant,
-                    transcript="",
-                    item_id="",
-                )
-            )
-        elif line_data["type"] == "response.audio.delta":
-            decoded_data = base64.b64decode(line_data["delta"])
-            segment_ms = (
-                (len(decoded_data) / bytes_per_sample) * 1000.0 / sample_rate
-            )
-            output_item_time_elapsed += segment_ms
-            audio_data.append(
+# start and end offsets into the audio buffer, ms of the chunk, elapsed ms
+# within its item, item id
+_AudioChunk = tuple[int, int, float, float, Optional[str]]
+
+
+class _AudioLogState:
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+        self.bytes_per_sample = 1 if sample_rate == 8000 else 2
+        self.speaker_segments: list[SpeakerSegment] = []
+        # positions of the segments carrying each item id, in order
+        self.segment_indices_by_item_id: dict[str, list[int]] = {}
+        self.total_ms: float = 0
+        self.input_data_ms: float = 300
+        # copied per log so the append handler can be swapped for whichever
+        # speaking mode the log is in
+        self.handlers = dict(_AUDIO_LOG_HANDLERS)
+        # every decoded chunk is appended here once, chunks only hold offsets
+        # so truncating one is an offset change rather than a copy
+        self.audio_buffer = bytearray()
+        self.input_buffer_data: list[tuple[int, int, float]] = []
+        self.audio_data: list[_AudioChunk] = []
+        self.audio_indices_by_item_id: dict[str, list[int]] = {}
+        self.segment_indices_to_remove: set[int] = set()
+        self.input_item_time_elapsed: float = 0
+        self.output_item_time_elapsed: float = 0
+        # range of segment indices to move back and the ms to move them by,
+        # applied once all truncations are known
+        self.timestamp_shifts: list[tuple[int, int, float]] = []
+
+    def add_segment(self, segment: SpeakerSegment) -> None:
+        if segment.item_id:
+            self.segment_indices_by_item_id.setdefault(
+                segment.item_id, []
+            ).append(len(self.speaker_segments))
+        self.speaker_segments.append(segment)
+
+    def set_last_segment_item_id(self, item_id: str) -> None:
+        self.speaker_segments[-1].item_id = item_id
+        self.segment_indices_by_item_id.setdefault(item_id, []).append(
+            len(self.speaker_segments) - 1
+        )
+
+    def segments_for_item(self, item_id: str) -> list[SpeakerSegment]:
+        return [
+            self.speaker_segments[i]
+            for i in self.segment_indices_by_item_id.get(item_id, [])
+        ]
+
+    def apply_timestamp_shifts(self) -> None:
+        if not self.timestamp_shifts:
+            return
+        # segments already logged after a truncated item were placed with
+        # the removed audio still counted, mark where each shift starts and
+        # stops so a running sum gives every segment its total shift
+        shifts_ms = np.zeros(len(self.speaker_segments) + 1)
+        for start, end, amount_ms in self.timestamp_shifts:
+            shifts_ms[start] += amount_ms
+            shifts_ms[end] -= amount_ms
+        offsets = np.cumsum(shifts_ms[:-1]) / 1000
+        for segment, offset in zip(self.speaker_segments, offsets.tolist()):
+            if offset:
+                segment.timestamp -= offset
+
+    def add_audio(self, decoded_data: bytes) -> tuple[int, int]:
+        start = len(self.audio_buffer)
+        self.audio_buffer += decoded_data
+        return start, len(self.audio_buffer)
+
+    def audio_ms(self, num_bytes: int) -> float:
+        return (num_bytes / self.bytes_per_sample) * 1000.0 / self.sample_rate
+
+
+_WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+# binascii directly, skipping b64decode's argument coercion per line
+_a2b_base64 = binascii.a2b_base64
+
+
+def _on_speech_started(line_data: dict, state: _AudioLogState) -> None:
+    state.output_item_time_elapsed = 0
+    state.handlers["input_audio_buffer.append"] = _on_user_audio_append
+    state.add_segment(
+        SpeakerSegment(
+            timestamp=state.total_ms / 1000,
+            speaker=Speaker.user,
+            transcript="",
+            item_id=line_data["item_id"],
+        )
+    )
+    audio_start_ms = line_data["audio_start_ms"]
+    for start, end, ms in state.input_buffer_data:
+        if ms >= audio_start_ms:
+            segment_ms = state.audio_ms(end - start)
+            state.input_item_time_elapsed += segment_ms
+            state.audio_data.append(
                 (
-                    decoded_data,
+                    start,
+                    end,
                     segment_ms,
-                    output_item_time_elapsed,
-                    line_data["item_id"],
+                    state.input_item_time_elapsed,
+                    None,
                 )
             )
-            total_ms += segment_ms
-
-            # check if the latest speaker does not have an item_id, if not, add one
-            if len(speaker_segments) == 0:
-                speaker_segments.append(
-                    SpeakerSegment(
-                        timestamp=total_ms / 1000,
-                        speaker=Speaker.assistant,
-                        transcript="",
-                        item_id=line_data["item_id"],
-                    )
-                )
-            elif speaker_segments[-1].item_id == "":
-                if speaker_segments[-1].speaker != Speaker.assistant:
-                    logger.exception(
-                        "Speaker segment does not have an item_id, but is not the assistant"
-                    )
-                else:
-                    speaker_segments[-1].item_id = line_data["item_id"]
-
-        elif line_data["type"] == "response.audio_transcript.done":
-            item_id = line_data["item_id"]
-
-            for segment in speaker_segments:
-                if segment.item_id == item_id:
-                    if segment.speaker != Speaker.assistant:
-                        logger.exception(
-                            "Matching segment is not the assistant"
-                        )
-                    else:
-                        segment.transcript = line_data["transcript"]
-                        break
-
-        elif line_data["type"] == "input_audio_buffer.append":
-            audio = line_data["audio"]
-            decoded_data = base64.b64decode(audio)
-            decoded_data_ms = (
-                (len(decoded_data) / bytes_per_sample) * 1000.0 / sample_rate
+            state.total_ms += segment_ms
+
+
+def _on_input_transcription_completed(
+    line_data: dict, state: _AudioLogState
+) -> None:
+    for segment in state.segments_for_item(line_data["item_id"]):
+        if segment.speaker != Speaker.user:
+            logger.exception("Matching segment is not the user")
+        else:
+            segment.transcript = line_data["transcript"]
+            break
+
+
+def _on_speech_stopped(line_data: dict, state: _AudioLogState) -> None:
+    state.handlers["input_audio_buffer.append"] = _on_input_audio_append
+    state.input_item_time_elapsed = 0
+    state.add_segment(
+        SpeakerSegment(
+            timestamp=state.total_ms / 1000,
+            speaker=Speaker.assistant,
+            transcript="",
+            item_id="",
+        )
+    )
+
+
+def _on_audio_delta(line_data: dict, state: _AudioLogState) -> None:
+    start, end = state.add_audio(_a2b_base64(line_data["delta"]))
+    segment_ms = state.audio_ms(end - start)
+    state.output_item_time_elapsed += segment_ms
+    state.audio_indices_by_item_id.setdefault(line_data["item_id"], []).append(
+        len(state.audio_data)
+    )
+    state.audio_data.append(
+        (
+            start,
+            end,
+            segment_ms,
+            state.output_item_time_elapsed,
+            line_data["item_id"],
+        )
+    )
+    state.total_ms += segment_ms
+
+    # check if the latest speaker does not have an item_id, if not, add one
+    speaker_segments = state.speaker_segments
+    if len(speaker_segments) == 0:
+        state.add_segment(
+            SpeakerSegment(
+                timestamp=state.total_ms / 1000,
+                speaker=Speaker.assistant,
+                transcript="",
+                item_id=line_data["item_id"],
+            )
+        )
+    elif speaker_segments[-1].item_id == "":
+        if speaker_segments[-1].speaker != Speaker.assistant:
+            logger.exception(
+                "Speaker segment does not have an item_id, but is not the assistant"
             )
-            input_data_ms += decoded_data_ms
-            if user_speaking:
-                total_ms += decoded_data_ms
-                input_item_time_elapsed += decoded_data_ms
-                audio_data.append(
-                    (
-                        decoded_data,
-                        decoded_data_ms,
-                        input_item_time_elapsed,
-                        None,
-                    )
+        else:
+            state.set_last_segment_item_id(line_data["item_id"])
+
+
+def _on_audio_transcript_done(line_data: dict, state: _AudioLogState) -> None:
+    for segment in state.segments_for_item(line_data["item_id"]):
+        if segment.speaker != Speaker.assistant:
+            logger.exception("Matching segment is not the assistant")
+        else:
+            segment.transcript = line_data["transcript"]
+            break
+
+
+def _on_input_audio_append(line_data: dict, state: _AudioLogState) -> None:
+    # user is not speaking, buffer the audio until speech starts
+    start, end = state.add_audio(_a2b_base64(line_data["audio"]))
+    state.input_data_ms += state.audio_ms(end - start)
+    state.input_buffer_data.append((start, end, state.input_data_ms))
+
+
+def _on_user_audio_append(line_data: dict, state: _AudioLogState) -> None:
+    start, end = state.add_audio(_a2b_base64(line_data["audio"]))
+    decoded_data_ms = state.audio_ms(end - start)
+    state.input_data_ms += decoded_data_ms
+    state.total_ms += decoded_data_ms
+    state.input_item_time_elapsed += decoded_data_ms
+    state.audio_data.append(
+        (
+            start,
+            end,
+            decoded_data_ms,
+            state.input_item_time_elapsed,
+            None,
+        )
+    )
+
+
+def _on_item_truncated(line_data: dict, state: _AudioLogState) -> None:
+    audio_data = state.audio_data
+    amount_to_remove = 0
+    for i in state.audio_indices_by_item_id.get(line_data["item_id"], []):
+        start, end, segment_ms, elapsed_ms, _ = audio_data[i]
+        if line_data["audio_end_ms"] < elapsed_ms:
+            # check previous elapsed_ms, and if it's not less than audio_end_ms, then this is a partially truncated segment.
+            if i > 0 and line_data["audio_end_ms"] >= audio_data[i - 1][3]:
+                # figure out number of bytes to remove
+                segment_ms_to_remove = elapsed_ms - line_data["audio_end_ms"]
+                amount_to_remove += segment_ms_to_remove
+                num_bytes_to_remove = int(
+                    segment_ms_to_remove
+                    * state.sample_rate
+                    * state.bytes_per_sample
+                    / 1000
+                )
+                # matches slicing the chunk with [:-num_bytes_to_remove]
+                new_end = (
+                    max(start, end - num_bytes_to_remove)
+                    if num_bytes_to_remove > 0
+                    else start
                 )
+                audio_data[i] = (start, new_end) + audio_data[i][2:]
             else:
-                input_buffer_data.append((decoded_data, input_data_ms))
-
-        elif line_data["type"] == "conversation.item.truncated":
-            amount_to_remove = 0
-            for i, (_, segment_ms, elapsed_ms, item_id) in enumerate(
-                audio_data
-            ):
-                if (
-                    item_id is not None
-                    and item_id == line_data["item_id"]
-                    and line_data["audio_end_ms"] < elapsed_ms
-                ):
-                    # check previous elapsed_ms, and if it's not less than audio_end_ms, then this is a partially truncated segment.
-                    if (
-                        i > 0
-                        and line_data["audio_end_ms"] >= audio_data[i - 1][2]
-                    ):
-                        # figure out number of bytes to remove
-                        segment_ms_to_remove = (
-                            elapsed_ms - line_data["audio_end_ms"]
-                        )
-                        amount_to_remove += segment_ms_to_remove
-                        num_bytes_to_remove = int(
-                            segment_ms_to_remove
-                            * sample_rate
-                            * bytes_per_sample
-                            / 1000
-                        )
-                        audio_data[i] = (
-                            audio_data[i][0][:-num_bytes_to_remove],
-                            audio_data[i][1],
-                            audio_data[i][2],
-                            audio_data[i][3],
-                        )
-                    else:
-                        amount_to_remove += segment_ms
-                        segment_indices_to_remove.add(i)
-            for i, speaker_segment in enumerate(speaker_segments):
-                if speaker_segment.item_id == line_data["item_id"]:
-                    speaker_segments[i + 1].timestamp -= (
-                        amount_to_remove / 1000
-                    )
-            total_ms -= amount_to_remove
-    final_audio_data = bytearray()
-    for i, (audio_bytes, _, _, _) in enumerate(audio_data):
-        if i not in segment_indices_to_remove:
-            final_audio_data.extend(audio_bytes)
-    return speaker_segments, final_audio_data
+                amount_to_remove += segment_ms
+                state.segment_indices_to_remove.add(i)
+    segment_indices = state.segment_indices_by_item_id.get(
+        line_data["item_id"]
+    )
+    if segment_indices and amount_to_remove:
+        # segments logged from here on already see the reduced total
+        state.timestamp_shifts.append(
+            (
+                segment_indices[-1] + 1,
+                len(state.speaker_segments),
+                amount_to_remove,
+            )
+        )
+    state.total_ms -= amount_to_remove
+
+
+# built once, looked up for every log line
+_AUDIO_LOG_HANDLERS: dict[str, Callable[[dict, _AudioLogState], None]] = {
+    "input_audio_buffer.speech_started": _on_speech_started,
+    "conversation.item.input_audio_transcription.completed": (
+        _on_input_transcription_completed
+    ),
+    "input_audio_buffer.speech_stopped": _on_speech_stopped,
+    "response.audio.delta": _on_audio_delta,
+    "response.audio_transcript.done": _on_audio_transcript_done,
+    "input_audio_buffer.append": _on_input_audio_append,
+    "conversation.item.truncated": _on_item_truncated,
+}
+
+
+def process_audio_data(
+    log_file: IO[bytes],
+    sample_rate: int,
+) -> tuple[list[SpeakerSegment], bytes]:
+    state = _AudioLogState(sample_rate)
+    get_handler = state.handlers.get
+    # iterate the file so the log is parsed line by line as it is read
+    for line in log_file:
+        # exlcude timestamp, orjson parses the bytes as is
+        line_data = orjson.loads(line.split(b"]", 1)[1])
+        handler = get_handler(line_data["type"])
+        if handler is not None:
+            handler(line_data, state)
+    state.apply_timestamp_shifts()
+    # a single join sizes the output once instead of growing it per chunk
+    segment_indices_to_remove = state.segment_indices_to_remove
+    audio_view = memoryview(state.audio_buffer)
+    final_audio_data = b"".join(
+        audio_view[start:end]
+        for i, (start, end, _, _, _) in enumerate(state.audio_data)
+        if i not in segment_indices_to_remove
+    )
+    return state.speaker_segments, final_audio_data
 
 
 def calculate_bar_heights(
@@ -217,8 +309,16 @@ def calculate_bar_heights(
         (num_bars, samples_per_bar)
     )
 
-    # Calculate RMS for each segment using numpy operations
-    rms = np.sqrt(np.mean(segments.astype(np.float32) ** 2, axis=1))
+    # Calculate RMS for each segment, summing squares straight from the
+    # samples rather than materializing a float copy of the audio, pcm is
+    # accumulated exactly as integers, decoded audio is already float
+    accumulator = (
+        np.int64 if np.issubdtype(segments.dtype, np.integer) else np.float64
+    )
+    sum_of_squares = np.einsum(
+        "ij,ij->i", segments, segments, dtype=accumulator
+    )
+    rms = np.sqrt(sum_of_squares / samples_per_bar)
 
     # Normalize to 0-1 range using 90% of max value instead of fixed 16-bit maximum
     max_value = np.max(rms)
@@ -229,24 +329,26 @@ def calculate_bar_heights(
     ms_per_bar = samples_per_bar / samples_per_ms
     bar_timestamps = np.arange(num_bars) * ms_per_bar / 1000
 
-    # Create arrays of segment timestamps and speakers
-    segment_timestamps = np.array(
-        [segment.timestamp for segment in speaker_segments]
-    )
-    segment_speakers = np.array(
-        [segment.speaker.value for segment in speaker_segments]
+    # Only the timestamps need an array, speakers are picked from the
+    # segments by index
+    segment_timestamps = np.fromiter(
+        (segment.timestamp for segment in speaker_segments),
+        dtype=np.float64,
+        count=len(speaker_segments),
     )
 
     # Find the corresponding speaker for each bar using numpy searchsorted
     speaker_indices = (
         np.searchsorted(segment_timestamps, bar_timestamps, side="right") - 1
     )
-    bar_speakers = segment_speakers[speaker_indices]
+    bar_speakers = [
+        speaker_segments[index].speaker for index in speaker_indices.tolist()
+    ]
 
     assert len(normalized_heights) == len(bar_speakers)
     return [
         BarHeight(height=height, speaker=speaker)
-        for height, speaker in zip(normalized_heights, bar_speakers)
+        for height, speaker in zip(normalized_heights.tolist(), bar_speakers)
     ]
 
 
@@ -256,11 +358,28 @@ def audio_bytes_to_ms(
     return int((len(audio_bytes) / bytes_per_sample) * 1000 / sample_rate)
 
 
-def pcm_to_wav_buffer(audio_data: bytes, sample_rate: int) -> io.BytesIO:
-    wav_buffer = io.BytesIO()
-    with wave.open(wav_buffer, "wb") as wav_file:
-        wav_file.setnchannels(1)
-        wav_file.setsampwidth(2)
-        wav_file.setframerate(sample_rate)
-        wav_file.writeframes(audio_data)
-    return wav_buffer
+def base64_decoded_length(audio_b64: str) -> int:
+    # size of the decoded payload without materializing it
+    padding = 2 if audio_b64.endswith("==") else audio_b64.endswith("=")
+    return len(audio_b64) // 4 * 3 - padding
+
+
+def pcm_to_wav_bytes(audio_data: bytes, sample_rate: int) -> bytes:
+    # 16-bit mono pcm has a fixed 44 byte header, so it is packed directly
+    # rather than written out through the wave module
+    header = _WAV_HEADER.pack(
+        b"RIFF",
+        36 + len(audio_data),
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        1,
+        sample_rate,
+        sample_rate * 2,
+        2,
+        16,
+        b"data",
+        len(audio_data),
+    )
+    return header + audio_data
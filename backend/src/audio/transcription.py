@@ -101,4 +101,5 @@ async def create_transcription(
         json.dumps(response).encode("utf-8"),
         transcript_file,
         "application/json",
+        compress=True,
     )
@@ -1,7 +1,13 @@
+import base64
+import hashlib
 import logging
+import time
 
-from fastapi import Depends, HTTPException
+import orjson
+from cachetools import TTLCache
+from fastapi import Depends, HTTPException, Request
 from propelauth_fastapi import init_auth
+from propelauth_py.errors import UnauthorizedException
 from propelauth_py.user import User
 
 from src.settings import settings
@@ -10,8 +16,45 @@ logger = logging.getLogger(__name__)
 
 _auth = init_auth(settings.auth_url, settings.auth_api_key)
 
+# validated users by a digest of their authorization header, along with
+# the token's expiry. An entry is never served past that expiry, but a
+# token revoked upstream can still be accepted for up to the cache ttl.
+# The dependency is async so the cache is only touched from the event loop.
+_user_cache: TTLCache[bytes, tuple[User, float]] = TTLCache(
+    maxsize=10_000, ttl=60
+)
 
-def require_user(user: User = Depends(_auth.require_user)) -> User:
+
+def _token_expiry(authorization_header: str) -> float:
+    # only read once the token has been validated, so its claims are trusted
+    try:
+        claims = authorization_header.split(" ", 1)[1].split(".")[1]
+        claims += "=" * (-len(claims) % 4)
+        return float(orjson.loads(base64.urlsafe_b64decode(claims))["exp"])
+    except Exception:
+        # without a readable expiry the token is not cached
+        return 0.0
+
+
+async def _validated_user(request: Request) -> User:
+    authorization_header = request.headers.get("Authorization", "")
+    cache_key = hashlib.blake2b(
+        authorization_header.encode(), digest_size=16
+    ).digest()
+    cached = _user_cache.get(cache_key)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+    try:
+        user = _auth.validate_access_token_and_get_user(authorization_header)
+    except UnauthorizedException:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    expiry = _token_expiry(authorization_header)
+    if expiry > 0:
+        _user_cache[cache_key] = (user, expiry)
+    return user
+
+
+def require_user(user: User = Depends(_validated_user)) -> User:
     org_map = user.org_id_to_org_member_info
     if org_map is None:
         raise HTTPException(
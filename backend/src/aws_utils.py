@@ -1,26 +1,53 @@
+import asyncio
+import gzip
 import logging
 from contextlib import AsyncExitStack
+from functools import lru_cache
 from typing import AsyncContextManager, Optional
 
 from aiobotocore.client import AioBaseClient
+from aiobotocore.config import AioConfig
 from aiobotocore.session import AioSession
 from botocore.exceptions import ClientError
+from cachetools import TTLCache
 
 from src.settings import settings
 
 logger = logging.getLogger(__name__)
 
+# objects above one part are uploaded as parallel parts
+MULTIPART_PART_SIZE = 16 * 1024 * 1024
+MULTIPART_CONCURRENCY = 8
+# writers opt in to gzip, readers decompress from ContentEncoding
+MIN_COMPRESS_SIZE = 4096
+
+
+@lru_cache(maxsize=4096)
+def _bucket_prefix_from_file_url(file_url: str) -> tuple[str, str]:
+    bucket, _, prefix = file_url.split("://")[1].partition("/")
+    return bucket, prefix
+
 
 class S3Client(AsyncContextManager["S3Client"]):
     def __init__(self):
         self._exit_stack = AsyncExitStack()
         self._s3_client: Optional[AioBaseClient] = None
+        # files this client has recently seen exist, missing files are always
+        # re-checked. Bounded and expiring since the shared client lives as
+        # long as the server and objects can be removed outside of it.
+        self._exists_cache: TTLCache[str, bool] = TTLCache(
+            maxsize=4096, ttl=300
+        )
 
     async def __aenter__(self) -> "S3Client":
         session = AioSession()
         self._s3_client = await self._exit_stack.enter_async_context(
             session.create_client(
-                "s3", region_name=settings.aws_default_region
+                "s3",
+                region_name=settings.aws_default_region,
+                config=AioConfig(
+                    max_pool_connections=MULTIPART_CONCURRENCY * 2
+                ),
             )
         )
         return self
@@ -30,35 +57,99 @@ class S3Client(AsyncContextManager["S3Client"]):
 
     @staticmethod
     def bucket_prefix_from_file_url(file_url: str) -> tuple[str, str]:
-        path_splits = file_url.split("://")[1].split("/")
-        bucket = path_splits[0]
-        prefix = "/".join(path_splits[1:])
-        return bucket, prefix
+        return _bucket_prefix_from_file_url(file_url)
 
     async def upload_file(
         self,
         obj: bytes,
         filepath: str,
         content_type: Optional[str] = None,
+        compress: bool = False,
     ) -> None:
         bucket, prefix = self.bucket_prefix_from_file_url(filepath)
-        base_params = {
-            "Bucket": bucket,
-            "Key": prefix,
-            "Body": obj,
-        }
-        if content_type:
-            base_params["ContentType"] = content_type
-        await self._s3_client.put_object(**base_params)  # type: ignore
+        # not trusted again until the overwrite completes
+        self._exists_cache.pop(filepath, None)
+        content_encoding = None
+        if compress and len(obj) > MIN_COMPRESS_SIZE:
+            obj = gzip.compress(obj, compresslevel=1)
+            content_encoding = "gzip"
+        if len(obj) > MULTIPART_PART_SIZE:
+            await self._upload_multipart(
+                obj, bucket, prefix, content_type, content_encoding
+            )
+        else:
+            base_params = {
+                "Bucket": bucket,
+                "Key": prefix,
+                "Body": obj,
+            }
+            if content_type:
+                base_params["ContentType"] = content_type
+            if content_encoding:
+                base_params["ContentEncoding"] = content_encoding
+            await self._s3_client.put_object(**base_params)  # type: ignore
+        self._exists_cache[filepath] = True
         logger.info(f"Successfully uploaded to {bucket=} {prefix=}")
 
+    async def _upload_multipart(
+        self,
+        obj: bytes,
+        bucket: str,
+        prefix: str,
+        content_type: Optional[str],
+        content_encoding: Optional[str],
+    ) -> None:
+        base_params = {"Bucket": bucket, "Key": prefix}
+        create_params = dict(base_params)
+        if content_type:
+            create_params["ContentType"] = content_type
+        if content_encoding:
+            create_params["ContentEncoding"] = content_encoding
+        upload = await self._s3_client.create_multipart_upload(**create_params)  # type: ignore
+        upload_id = upload["UploadId"]
+        semaphore = asyncio.Semaphore(MULTIPART_CONCURRENCY)
+
+        async def upload_part(part_number: int, start: int) -> dict:
+            async with semaphore:
+                response = await self._s3_client.upload_part(  # type: ignore
+                    **base_params,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=obj[start : start + MULTIPART_PART_SIZE],
+                )
+            return {"ETag": response["ETag"], "PartNumber": part_number}
+
+        try:
+            parts = await asyncio.gather(
+                *[
+                    upload_part(i + 1, start)
+                    for i, start in enumerate(
+                        range(0, len(obj), MULTIPART_PART_SIZE)
+                    )
+                ]
+            )
+        except Exception:
+            await self._s3_client.abort_multipart_upload(  # type: ignore
+                **base_params, UploadId=upload_id
+            )
+            raise
+        await self._s3_client.complete_multipart_upload(  # type: ignore
+            **base_params,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+
     async def download_file(self, filepath: str) -> tuple[bytes, str, str]:
         bucket, prefix = self.bucket_prefix_from_file_url(filepath)
         response = await self._s3_client.get_object(Bucket=bucket, Key=prefix)  # type: ignore
         body = await response["Body"].read()
+        if response.get("ContentEncoding") == "gzip":
+            body = gzip.decompress(body)
         return body, response["ContentType"], response["ETag"]
 
     async def check_file_exists(self, filepath: str) -> bool:
+        if filepath in self._exists_cache:
+            return True
         bucket, prefix = self.bucket_prefix_from_file_url(filepath)
         try:
             await self._s3_client.head_object(Bucket=bucket, Key=prefix)  # type: ignore
@@ -71,4 +162,29 @@ class S3Client(AsyncContextManager["S3Client"]):
                 return False
             else:
                 raise e
+        self._exists_cache[filepath] = True
         return True
+
+
+# one client shared by the whole server so its connection pool is reused,
+# opened and closed with the app lifespan
+_shared_s3_client: Optional[S3Client] = None
+
+
+async def open_s3_client() -> None:
+    global _shared_s3_client
+    if _shared_s3_client is None:
+        _shared_s3_client = await S3Client().__aenter__()
+
+
+def get_s3_client() -> S3Client:
+    if _shared_s3_client is None:
+        raise RuntimeError("S3 client has not been opened")
+    return _shared_s3_client
+
+
+async def close_s3_client() -> None:
+    global _shared_s3_client
+    if _shared_s3_client is not None:
+        await _shared_s3_client.__aexit__(None, None, None)
+        _shared_s3_client = None
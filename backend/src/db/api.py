@@ -1,7 +1,7 @@
 import logging
 from typing import Optional
 
-from sqlalchemy import Select, insert, or_, select, update
+from sqlalchemy import Integer, Select, func, insert, or_, select, update
 from sqlalchemy.ext.asyncio import async_scoped_session
 from sqlalchemy.orm import joinedload, selectinload
 
@@ -100,19 +100,16 @@ async def update_phone_call(
     phone_call_end_reason: PhoneCallEndReason,
     db: async_scoped_session,
 ) -> None:
-    payload = {}
+    # an end reason that is already set is kept, the database checks it in
+    # the same statement
+    payload: dict = {
+        "end_reason": func.coalesce(
+            PhoneCallModel.end_reason, phone_call_end_reason.value
+        )
+    }
     if call_data is not None:
         payload["call_data"] = call_data
 
-    # check if an end reason already exists
-    result = await db.execute(
-        select(PhoneCallModel)
-        .where(PhoneCallModel.id == phone_call_id)
-        .where(PhoneCallModel.end_reason.isnot(None))
-    )
-    if result.scalar_one_or_none() is None:
-        payload["end_reason"] = phone_call_end_reason.value
-
     await db.execute(
         update(PhoneCallModel)
         .where(PhoneCallModel.id == phone_call_id)
@@ -122,10 +119,27 @@ async def update_phone_call(
 
 async def get_phone_calls(
     organization_id: str, db: async_scoped_session
-) -> list[PhoneCallModel]:
+) -> list[tuple[PhoneCallModel, Optional[dict]]]:
+    # the listing only shows the latest status event, so it is picked in
+    # sql instead of loading every event of every call
+    latest_event_payload = (
+        select(PhoneCallEventModel.payload)
+        .where(PhoneCallEventModel.phone_call_id == PhoneCallModel.id)
+        .where(PhoneCallEventModel.payload["CallStatus"].astext.isnot(None))
+        .order_by(
+            # postgres sorts nulls first when descending
+            PhoneCallEventModel.payload["SequenceNumber"]
+            .astext.cast(Integer)
+            .desc()
+            .nulls_last(),
+            PhoneCallEventModel.created_at.desc(),
+        )
+        .limit(1)
+        .correlate(PhoneCallModel)
+        .scalar_subquery()
+    )
     result = await db.execute(
-        select(PhoneCallModel)
-        .options(selectinload(PhoneCallModel.events))
+        select(PhoneCallModel, latest_event_payload)
         .options(
             joinedload(PhoneCallModel.agent).selectinload(
                 AgentModel.phone_numbers
@@ -134,7 +148,7 @@ async def get_phone_calls(
         .where(PhoneCallModel.organization_id == organization_id)
         .order_by(PhoneCallModel.created_at.desc())
     )
-    return list(result.scalars().all())
+    return [(phone_call, payload) for phone_call, payload in result.all()]
 
 
 async def insert_agent(
@@ -633,19 +647,20 @@ async def get_text_messages_from_workflow(
     workflow_id: SerializedUUID,
     db: async_scoped_session,
 ) -> list[TextMessageModel]:
-    event_link_ids_raw = await db.execute(
+    # the linked ids stay in the database as a subquery, so the messages
+    # come back in one round trip
+    event_link_ids = (
         select(AgentWorkflowEventModel.event_link_id)
         .where(AgentWorkflowEventModel.agent_workflow_id == workflow_id)
         .where(
-            or_(
-                AgentWorkflowEventModel.event_type
-                == AgentWorkflowEventType.inbound_text_message.value,
-                AgentWorkflowEventModel.event_type
-                == AgentWorkflowEventType.outbound_text_message.value,
+            AgentWorkflowEventModel.event_type.in_(
+                [
+                    AgentWorkflowEventType.inbound_text_message.value,
+                    AgentWorkflowEventType.outbound_text_message.value,
+                ]
             )
         )
     )
-    event_link_ids = [event_link_id for event_link_id, in event_link_ids_raw]
 
     result = await db.execute(
         select(TextMessageModel)
@@ -47,8 +47,14 @@ def latest_phone_call_event(phone_call: PhoneCallModel) -> Optional[dict]:
 
 
 def convert_phone_call_model(phone_call: PhoneCallModel) -> PhoneCallMetadata:
-    # get latest event status
-    event_payload = latest_phone_call_event(phone_call)
+    return convert_phone_call_model_with_event(
+        phone_call, latest_phone_call_event(phone_call)
+    )
+
+
+def convert_phone_call_model_with_event(
+    phone_call: PhoneCallModel, event_payload: Optional[dict]
+) -> PhoneCallMetadata:
     if event_payload is None:
         event_payload = {
             "CallStatus": PhoneCallStatus.queued,
@@ -7,6 +7,7 @@ from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import async_scoped_session
 
 from src.ai.instructions_update import (
+    InstructionUpdateError,
     generate_updated_instructions_from_report,
 )
 from src.ai.prompts import default_system_prompt
@@ -237,10 +238,20 @@ async def update_instructions_from_report(
         raise HTTPException(status_code=404, detail="Report not found")
     if report.group.organization_id != user.active_org_id:
         raise HTTPException(status_code=403, detail="Report not found")
-    updated_instructions = await generate_updated_instructions_from_report(
-        cast(str, agent.system_message), cast(str, report.text)
-    )
+    try:
+        updated_instructions = await generate_updated_instructions_from_report(
+            cast(str, agent.system_message), cast(str, report.text)
+        )
+    except InstructionUpdateError as e:
+        raise HTTPException(status_code=502, detail=str(e))
     base_id = cast(SerializedUUID, agent.base_id)
+    if updated_instructions == agent.system_message:
+        # nothing to change, so the current version is returned instead of
+        # saving a duplicate
+        return UpdateInstructionsFromReportResponse(
+            base_id=base_id,
+            version_id=agent_id,
+        )
     new_agent_id = await insert_agent(
         AgentBase(
             name=cast(str, agent.name),
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 from typing import cast
 from uuid import uuid4
@@ -110,7 +109,4 @@ async def call_stream(
             organization_id=cast(str, phone_call_model.organization_id),
             ai_caller=ai,
         )
-        await asyncio.gather(
-            call_router.receive_from_human_call(websocket),
-            call_router.send_to_human(websocket),
-        )
+        await call_router.run(websocket)
@@ -11,7 +11,7 @@ from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import async_scoped_session
 
 from src.auth import User, require_user
-from src.aws_utils import S3Client
+from src.aws_utils import get_s3_client
 from src.db.api import (
     create_knowledge_base,
     get_knowledge_base,
@@ -64,17 +64,17 @@ async def upload_documents(
         for i, file in enumerate(files)
     ]
 
-    async with S3Client() as s3:
-        await asyncio.gather(
-            *[
-                s3.upload_file(
-                    data,
-                    _doc_save_path(str(user.active_org_id), filename),
-                    mime_type,
-                )
-                for filename, data, mime_type in file_data
-            ]
-        )
+    s3 = get_s3_client()
+    await asyncio.gather(
+        *[
+            s3.upload_file(
+                data,
+                _doc_save_path(str(user.active_org_id), filename),
+                mime_type,
+            )
+            for filename, data, mime_type in file_data
+        ]
+    )
 
     documents = []
     for filename, data, mime_type in file_data:
@@ -30,12 +30,12 @@ from src.ai.signup_verification import signup_verification_status_prompt
 from src.audio.audio_router import CallRouter
 from src.audio.data_processing import (
     calculate_bar_heights,
-    pcm_to_wav_buffer,
+    pcm_to_wav_bytes,
     process_audio_data,
 )
 from src.audio.sounds import get_sound_base64
 from src.auth import User, require_user
-from src.aws_utils import S3Client
+from src.aws_utils import S3Client, get_s3_client
 from src.db.api import (
     check_organization_owns_agent,
     get_agent,
@@ -55,7 +55,7 @@ from src.db.api import (
 from src.db.base import async_session_scope, get_session
 from src.db.converter import (
     convert_agent_phone_number,
-    convert_phone_call_model,
+    convert_phone_call_model_with_event,
     convert_text_message_model,
     latest_phone_call_event,
 )
@@ -440,10 +440,7 @@ async def call_stream(
             ai_caller=ai,
             call_type=cast(PhoneCallType, phone_call.call_type),
         )
-        await asyncio.gather(
-            call_router.receive_from_human_call(websocket),
-            call_router.send_to_human(websocket),
-        )
+        await call_router.run(websocket)
 
 
 @router.get(
@@ -513,7 +510,7 @@ async def hang_up(
         db,
     )
     await db.commit()
-    hang_up_phone_call(phone_call_sid)
+    await hang_up_phone_call(phone_call_sid)
     if phone_call_id in call_messages:
         call_messages[phone_call_id].end_call()
     return Response(status_code=204)
@@ -528,7 +525,10 @@ async def get_call_history(
     db: async_scoped_session = Depends(get_session),
 ) -> list[PhoneCallMetadata]:
     phone_calls = await get_phone_calls(cast(str, user.active_org_id), db)
-    return [convert_phone_call_model(phone_call) for phone_call in phone_calls]
+    return [
+        convert_phone_call_model_with_event(phone_call, event_payload)
+        for phone_call, event_payload in phone_calls
+    ]
 
 
 class AudioTranscriptResponse(BaseModel):
@@ -576,25 +576,27 @@ async def _handle_audio_playback_download_upload_file(
     )
 
 
-async def _handle_audio_playback_download_log_file(
-    s3_client: S3Client,
-    file_path: str,
+def _build_log_playback(
+    file_data: bytes,
+    mime_type: str,
     browser_call: bool,
 ) -> AudioTranscriptResponse:
-    file_data, mime_type, _ = await s3_client.download_file(file_path)
-
+    sample_rate = 8000 if not browser_call else 24000
     if mime_type == "application/zip":
         # Handle zipped file
         with zipfile.ZipFile(io.BytesIO(file_data)) as zip_file:
             # Get first file in zip (should be the log file)
             log_filename = zip_file.namelist()[0]
+            # stream the decompressed log rather than reading it whole
             with zip_file.open(log_filename) as log_file:
-                log_data = log_file.read()
+                speaker_segments, audio_data = process_audio_data(
+                    log_file, sample_rate
+                )
     else:
         # Handle unzipped file
-        log_data = file_data
-    sample_rate = 8000 if not browser_call else 24000
-    speaker_segments, audio_data = process_audio_data(log_data, sample_rate)
+        speaker_segments, audio_data = process_audio_data(
+            io.BytesIO(file_data), sample_rate
+        )
     if sample_rate == 8000:
         audio_data = audioop.ulaw2lin(audio_data, 2)
 
@@ -603,8 +605,8 @@ async def _handle_audio_playback_download_log_file(
         samples, 50, speaker_segments, sample_rate
     )
 
-    wav_buffer = pcm_to_wav_buffer(audio_data, sample_rate)
-    audio_data_b64 = base64.b64encode(wav_buffer.getvalue()).decode("utf-8")
+    wav_data = pcm_to_wav_bytes(audio_data, sample_rate)
+    audio_data_b64 = base64.b64encode(wav_data).decode("utf-8")
 
     return AudioTranscriptResponse(
         speaker_segments=speaker_segments,
@@ -615,6 +617,19 @@ async def _handle_audio_playback_download_log_file(
     )
 
 
+async def _handle_audio_playback_download_log_file(
+    s3_client: S3Client,
+    file_path: str,
+    browser_call: bool,
+) -> AudioTranscriptResponse:
+    file_data, mime_type, _ = await s3_client.download_file(file_path)
+    # replaying a log is cpu bound, keep it off the event loop that is also
+    # serving live call audio
+    return await asyncio.to_thread(
+        _build_log_playback, file_data, mime_type, browser_call
+    )
+
+
 @router.get(
     "/playback/{phone_call_id}",
     response_model=AudioTranscriptResponse,
@@ -632,17 +647,17 @@ async def get_audio_playback(
             status_code=403,
             detail="Permission denied to access this phone call",
         )
-    async with S3Client() as s3_client:
-        file_path = cast(str, phone_call.call_data)
-        if "/logs/" in file_path:
-            response = await _handle_audio_playback_download_log_file(
-                s3_client,
-                file_path,
-                cast(str, phone_call.from_phone_number) == BROWSER_NAME,
-            )
-        else:
-            response = await _handle_audio_playback_download_upload_file(
-                s3_client, file_path
-            )
+    s3_client = get_s3_client()
+    file_path = cast(str, phone_call.call_data)
+    if "/logs/" in file_path:
+        response = await _handle_audio_playback_download_log_file(
+            s3_client,
+            file_path,
+            cast(str, phone_call.from_phone_number) == BROWSER_NAME,
+        )
+    else:
+        response = await _handle_audio_playback_download_upload_file(
+            s3_client, file_path
+        )
 
     return response
@@ -5,11 +5,15 @@ import sentry_sdk
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 
+from src.ai.api import close_model_client
 from src.audio.sounds import initialize_sounds_cache
+from src.aws_utils import close_s3_client, open_s3_client
 from src.db.base import db_setup, shutdown_session
 from src.routes import agent, analytics, browser, knowledge_base, phone, user
 from src.settings import settings, setup_logging
+from src.twilio_utils import close_twilio_async_client
 from src.worker.worker import start_worker
 
 setup_logging()
@@ -25,14 +29,19 @@ if settings.sentry_dsn is not None:
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await db_setup()
+    await open_s3_client()
     await initialize_sounds_cache()
     asyncio.create_task(start_worker())
     yield
     await shutdown_session()
+    await close_model_client()
+    await close_twilio_async_client()
+    await close_s3_client()
 
 
 app = FastAPI(
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     openapi_url=None,
     docs_url=None,
     redoc_url=None,
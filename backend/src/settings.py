@@ -8,6 +8,7 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     openai_api_key: str
+    openai_max_concurrency: int = 50
     log_level: str = "INFO"
     aws_default_region: str = "us-west-2"
     twilio_username: str
@@ -1,5 +1,6 @@
 from typing import Optional
 
+from twilio.http.async_http_client import AsyncTwilioHttpClient
 from twilio.request_validator import RequestValidator
 from twilio.rest import Client
 
@@ -13,9 +14,34 @@ twilio_client = Client(
 )
 twilio_request_validator = RequestValidator(settings.twilio_auth_token)
 
+# the async client's pooled http session has to be created inside the event
+# loop, so it is initialized on first use
+_twilio_async_client: Optional[Client] = None
 
-def hang_up_phone_call(call_sid: str):
-    twilio_client.calls(call_sid).update(status="completed")
+
+def _get_twilio_async_client() -> Client:
+    global _twilio_async_client
+    if _twilio_async_client is None:
+        _twilio_async_client = Client(
+            account_sid=settings.twilio_account_sid,
+            password=settings.twilio_password,
+            username=settings.twilio_username,
+            http_client=AsyncTwilioHttpClient(),
+        )
+    return _twilio_async_client
+
+
+async def close_twilio_async_client() -> None:
+    global _twilio_async_client
+    if _twilio_async_client is not None:
+        await _twilio_async_client.http_client.close()  # type: ignore
+        _twilio_async_client = None
+
+
+async def hang_up_phone_call(call_sid: str):
+    await _get_twilio_async_client().calls(call_sid).update_async(
+        status="completed"
+    )
 
 
 def transfer_call(call_sid: str, to_phone_number: str):
@@ -342,6 +342,40 @@ export const BrowserCallDisplay = (props: {
       console.error("WebSocket connection error", e);
     };
 
+    const handleServerEvent = (data: any) => {
+      if (data.event === "clear") {
+        outputWorkletRef.current?.port.postMessage({
+          type: "clear-buffers",
+        });
+      } else if (data.event === "media") {
+        // Send the base64 data directly to the worklet for processing
+        const pcm16Data = atob(data.payload);
+        const buffer = new ArrayBuffer(pcm16Data.length);
+        const view = new Uint8Array(buffer);
+
+        for (let i = 0; i < pcm16Data.length; i++) {
+          view[i] = pcm16Data.charCodeAt(i);
+        }
+
+        outputWorkletRef.current?.port.postMessage(
+          {
+            type: "process-audio",
+            payload: view,
+          },
+          [buffer]
+        );
+      } else if (data.event === "speaker_segments") {
+        setSpeakerSegments(data.payload);
+      } else if (data.event === "message") {
+        toast.info(
+          <div className="space-y-1">
+            <div className="font-bold text-sm">{data.payload.title}</div>
+            <div className="text-sm">{data.payload.body}</div>
+          </div>
+        );
+      }
+    };
+
     ws.onmessage = async (event) => {
       try {
         // parse json
@@ -349,36 +383,10 @@ export const BrowserCallDisplay = (props: {
 
         // TODO: handle speaker segements
 
-        if (data.event === "clear") {
-          outputWorkletRef.current?.port.postMessage({
-            type: "clear-buffers",
-          });
-        } else if (data.event === "media") {
-          // Send the base64 data directly to the worklet for processing
-          const pcm16Data = atob(data.payload);
-          const buffer = new ArrayBuffer(pcm16Data.length);
-          const view = new Uint8Array(buffer);
-
-          for (let i = 0; i < pcm16Data.length; i++) {
-            view[i] = pcm16Data.charCodeAt(i);
-          }
-
-          outputWorkletRef.current?.port.postMessage(
-            {
-              type: "process-audio",
-              payload: view,
-            },
-            [buffer]
-          );
-        } else if (data.event === "speaker_segments") {
-          setSpeakerSegments(data.payload);
-        } else if (data.event === "message") {
-          toast.info(
-            <div className="space-y-1">
-              <div className="font-bold text-sm">{data.payload.title}</div>
-              <div className="text-sm">{data.payload.body}</div>
-            </div>
-          );
+        // the server may batch several events into a single message
+        const events = Array.isArray(data) ? data : [data];
+        for (const eventData of events) {
+          handleServerEvent(eventData);
         }
       } catch (err) {
         console.error("Error processing server event:", err);